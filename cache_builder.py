@@ -0,0 +1,167 @@
+import bz2
+import cPickle as pickle
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+
+# builds a cache directory by converting every source file (in parallel), a manifest in the cache directory records
+# every completed file with the size, modification time and md5 of its source. an interrupted build resumes from the
+# manifest, and only new or changed source files are converted again.
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def _md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _get_source_record(path, md5=None):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': _md5(path) if md5 is None else md5}
+
+
+def _load_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+def _save_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+
+def _is_up_to_date(source_path, target_path, record):
+    if record is None or not os.path.isfile(target_path):
+        return False
+    stat = os.stat(source_path)
+    if stat.st_size != record['size']:
+        return False
+    if stat.st_mtime == record['mtime']:
+        return True
+    # the file was touched, only the content matters
+    return _md5(source_path) == record['md5']
+
+
+def _convert_single(convert_function, source_path, target_path):
+    # the target is written under a temporary name, so a partial target is never mistaken for a complete one
+    temporary_path = target_path + '.tmp'
+    convert_function(source_path, temporary_path)
+    os.rename(temporary_path, target_path)
+    return os.path.basename(source_path), _get_source_record(source_path)
+
+
+def _convert_single_star(args):
+    return _convert_single(*args)
+
+
+def build_cache(source_dir, cache_dir, source_suffix, target_suffix, convert_function, processes=None):
+    # convert_function(source_path, target_path) must be picklable (a module level function or a partial of one).
+    # the target of source file f is f + target_suffix in cache_dir.
+    assert os.path.exists(source_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    files = sorted([f for f in os.listdir(source_dir) if f.endswith(source_suffix)])
+    assert len(files) > 0
+    manifest = _load_manifest(cache_dir)
+
+    # drop the files that no longer exist in the source
+    for f in list(manifest.keys()):
+        if f not in files:
+            del manifest[f]
+            target_path = os.path.join(cache_dir, f + target_suffix)
+            if os.path.isfile(target_path):
+                os.remove(target_path)
+
+    tasks = []
+    for f in files:
+        source_path = os.path.join(source_dir, f)
+        target_path = os.path.join(cache_dir, f + target_suffix)
+        record = manifest.get(f)
+        if _is_up_to_date(source_path, target_path, record):
+            # refresh the modification time of touched files
+            manifest[f] = _get_source_record(source_path, record['md5'])
+        else:
+            manifest.pop(f, None)
+            tasks.append((convert_function, source_path, target_path))
+    _save_manifest(cache_dir, manifest)
+
+    if len(tasks) == 0:
+        print 'cache at {} is up to date ({} files)'.format(cache_dir, len(files))
+        return
+    print 'building cache at {} from {}: {} of {} files to convert'.format(cache_dir, source_dir, len(tasks), len(files))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for i, (f, record) in enumerate(pool.imap_unordered(_convert_single_star, tasks)):
+            # every completed file is recorded right away, so an interrupted build resumes from here
+            manifest[f] = record
+            _save_manifest(cache_dir, manifest)
+            print 'cached {} ({} of {})'.format(f, i + 1, len(tasks))
+    finally:
+        pool.close()
+        pool.join()
+    print 'cache created at {}'.format(cache_dir)
+
+
+def decompress_pickle(source_path, target_path):
+    with bz2.BZ2File(source_path, 'r') as compressed_file:
+        data = pickle.load(compressed_file)
+    with open(target_path, 'w') as cache_file:
+        pickle.dump(data, cache_file)
+
+
+def _load_paths(source_path, step_size):
+    with bz2.BZ2File(source_path, 'r') as compressed_file:
+        paths = pickle.load(compressed_file)
+    # asserting step sizes match
+    for (traj, _) in paths:
+        for i in range(len(traj) - 1):
+            assert np.linalg.norm(np.array(traj[i]) - np.array(traj[i + 1])) < step_size
+    return paths
+
+
+def paths_to_transitions(step_size, target_point_tuple, source_path, target_path):
+    paths = _load_paths(source_path, step_size)
+    transitions = []
+    for (traj, poses_trajectory) in paths:
+        goal_joints = traj[-1]
+        goal_pose = poses_trajectory[-1][target_point_tuple]
+        for i in range(len(traj) - 1):
+            joints = traj[i]
+            next_joints = traj[i + 1]
+            transition = (joints[1:], next_joints[1:], goal_joints[1:], goal_pose)
+            transitions.append(transition)
+    with open(target_path, 'w') as pickle_file:
+        pickle.dump(transitions, pickle_file)
+
+
+def paths_to_paths_cache(step_size, source_path, target_path):
+    paths = _load_paths(source_path, step_size)
+    with open(target_path, 'w') as pickle_file:
+        pickle.dump(paths, pickle_file)
+
+
+def produce_transitions(data_dir, cache_dir, config, processes=None):
+    from potential_point import PotentialPoint
+    print 'producing transition data from original trajectories at {}'.format(data_dir)
+    step_size = config['openrave_rl']['action_step_size'] + 0.00001
+    target_point = PotentialPoint.from_config(config)[-1]
+    build_cache(data_dir, cache_dir, '.path_pkl', '.transitions_cache',
+                functools.partial(paths_to_transitions, step_size, target_point.tuple), processes)
+
+
+def produce_paths(data_dir, cache_dir, config, processes=None):
+    print 'producing paths data from original trajectories at {}'.format(data_dir)
+    step_size = config['openrave_rl']['action_step_size'] + 0.00001
+    build_cache(data_dir, cache_dir, '.path_pkl', '.paths_cache', functools.partial(paths_to_paths_cache, step_size),
+                processes)
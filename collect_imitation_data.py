@@ -9,20 +9,17 @@ from data_collector import CollectorProcess, DataCollector
 
 class TrajectoryCollectorProcess(CollectorProcess):
     def _get_tuple(self, query_params=None):
-        trajectory = self.openrave_trajectory_generator.find_random_trajectory()
-        trajectory_poses = [
-            self.openrave_trajectory_generator.openrave_manager.get_potential_points_poses(step) for step in trajectory]
-        return trajectory, trajectory_poses
+        return self.openrave_trajectory_generator.find_random_trajectory_with_poses()
 
 
 class ImitationDataCollector(DataCollector):
     def _get_queue_size(self, number_of_threads):
         return 2 * number_of_threads
 
-    def _get_collector(self, config, queued_data_points, collector_specific_queue, params_file=None):
+    def _get_collector(self, config, batch_size, collector_specific_queue, params_file=None):
         return TrajectoryCollectorProcess(
-            config, queued_data_points, self.results_queue, collector_specific_queue, params_file,
-            init_trajectory_collector=True
+            config, batch_size, self.results_queue, collector_specific_queue, params_file,
+            init_trajectory_collector=True, planner_budget=self.planner_budget
         )
 
 
@@ -38,6 +35,8 @@ config['openrave_planner'] = {
     'planner_iterations_start': 100,
     'planner_iterations_increase': 10,
     'planner_iterations_decrease': 1,
+    # print the planner statistics of all the collectors every 100 attempts
+    'log_every': 100,
 }
 
 # scenario = 'simple'
@@ -64,6 +63,7 @@ while collected < number_of_trajectories:
     current_buffer = data_collector.generate_samples(trajectories_per_file)
     b = datetime.datetime.now()
     print 'data collection took: {}'.format(b - a)
+    print 'planner statistics: {}'.format(data_collector.planner_budget.get_statistics())
     dump_path = os.path.join(results_dir, 'temp_data_{}.path_pkl'.format(collected))
     compressed_file = bz2.BZ2File(dump_path, 'w')
     pickle.dump(current_buffer, compressed_file)
@@ -14,14 +14,11 @@ class VisionTrajectoryCollectorProcess(CollectorProcess):
         workspace_id = query_params[0]
         full_workspace_path = query_params[1]
 
-        params_need_to_change = self.openrave_trajectory_generator.openrave_manager.set_params(full_workspace_path)
-        if params_need_to_change:
-            # reset the counter
-            self.openrave_trajectory_generator.max_planner_iterations = 100
-
-        trajectory = self.openrave_trajectory_generator.find_random_trajectory()
-        trajectory_poses = [
-            self.openrave_trajectory_generator.openrave_manager.get_potential_points_poses(step) for step in trajectory]
+        # the planner budget is not reset when the workspace changes: it is shared by all the collectors, which work
+        # on interleaved workspaces
+        self.openrave_trajectory_generator.openrave_manager.set_params(full_workspace_path)
+
+        trajectory, trajectory_poses = self.openrave_trajectory_generator.find_random_trajectory_with_poses()
         # the result contains also the workspace used
         return workspace_id, trajectory, trajectory_poses
 
@@ -30,10 +27,11 @@ class VisionImitationDataCollector(DataCollector):
     def _get_queue_size(self, number_of_threads):
         return 2*number_of_threads
 
-    def _get_collector(self, config, queued_data_points, collector_specific_queue, params_file=None):
+    def _get_collector(self, config, batch_size, collector_specific_queue, params_file=None):
         return VisionTrajectoryCollectorProcess(
-            config, queued_data_points, self.results_queue, collector_specific_queue, params_file=None,
-            query_parameters_queue=self.query_parameters_queue, init_trajectory_collector=True
+            config, batch_size, self.results_queue, collector_specific_queue, params_file=None,
+            query_parameters_queue=self.query_parameters_queue, init_trajectory_collector=True,
+            planner_budget=self.planner_budget
         )
 
 
@@ -49,6 +47,8 @@ config['openrave_planner'] = {
     'planner_iterations_start': 100,
     'planner_iterations_increase': 10,
     'planner_iterations_decrease': 1,
+    # print the planner statistics of all the collectors every 100 attempts
+    'log_every': 100,
 }
 
 
@@ -89,6 +89,7 @@ while collected < len(collection_queries):
     current_buffer = data_collector.generate_samples(samples_per_file)
     b = datetime.datetime.now()
     print 'data collection took: {}'.format(b - a)
+    print 'planner statistics: {}'.format(data_collector.planner_budget.get_statistics())
 
     for t in current_buffer:
         workspace_id = t[0]
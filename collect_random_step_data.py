@@ -39,9 +39,13 @@ class RandomStepDataCollector(DataCollector):
     def _get_queue_size(self, number_of_threads):
         return 100*number_of_threads
 
-    def _get_collector(self, config, queued_data_points, collector_specific_queue, params_file=None):
+    def _get_batch_size(self):
+        # a random step is cheap, send the results in batches
+        return 50
+
+    def _get_collector(self, config, batch_size, collector_specific_queue, params_file=None):
         return RandomStepCollectorProcess(
-            config, queued_data_points, self.results_queue, collector_specific_queue, params_file,
+            config, batch_size, self.results_queue, collector_specific_queue, params_file,
             init_rl_interface=True)
 
 
@@ -1,15 +1,17 @@
 import copy
 import multiprocessing
 import Queue
-import time
+import numpy as np
 
 from openrave_rl_interface import OpenraveRLInterface
 from openrave_trajectory_generator import OpenraveTrajectoryGenerator
+from planner_budget import PlannerBudget
 
 
 class CollectorProcess(multiprocessing.Process):
-    def __init__(self, config, queued_data_points, result_queue, collector_specific_queue, params_file=None,
-                 query_parameters_queue=None, init_rl_interface=False, init_trajectory_collector=False):
+    def __init__(self, config, batch_size, result_queue, collector_specific_queue, params_file=None,
+                 query_parameters_queue=None, init_rl_interface=False, init_trajectory_collector=False,
+                 planner_budget=None):
         multiprocessing.Process.__init__(self)
         self.result_queue = result_queue
         self.collector_specific_queue = collector_specific_queue
@@ -18,39 +20,60 @@ class CollectorProcess(multiprocessing.Process):
         self.query_parameters_queue = query_parameters_queue
         self.init_rl_interface = init_rl_interface
         self.init_trajectory_collector = init_trajectory_collector
+        self.planner_budget = planner_budget
         # members to set at runtime
         self.openrave_trajectory_generator = None
         self.openrave_interface = None
-        self.queued_data_points = queued_data_points
+        # the data points are sent to the result queue in lists of (at most) batch_size
+        self.batch_size = batch_size
 
     def _get_tuple(self, query_params=None):
         pass
 
+    def _is_terminated(self):
+        try:
+            next_collector_specific_task = self.collector_specific_queue.get(block=False)
+        except Queue.Empty:
+            return False
+        self.collector_specific_queue.task_done()
+        task_type = next_collector_specific_task[0]
+        # need to terminate
+        return task_type == 1
+
+    def _collect_batch(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            if self.query_parameters_queue is None:
+                batch.append(self._get_tuple())
+            else:
+                try:
+                    query_parameters = self.query_parameters_queue.get(block=True, timeout=0.1)
+                except Queue.Empty:
+                    # no more queries, send what was collected so far
+                    break
+                batch.append(self._get_tuple(query_parameters))
+        return batch
+
     def _run_main_loop(self):
-        while True:
-            try:
-                next_collector_specific_task = self.collector_specific_queue.get(block=True, timeout=0.001)
-                task_type = next_collector_specific_task[0]
-                if task_type == 1:
-                    # need to terminate
-                    self.collector_specific_queue.task_done()
+        while not self._is_terminated():
+            batch = self._collect_batch()
+            if len(batch) == 0:
+                continue
+            # the result queue is bounded: wait while it is full, but keep listening for the terminate message
+            while True:
+                try:
+                    self.result_queue.put(batch, block=True, timeout=1.0)
                     break
-            except Queue.Empty:
-                pass
-            if self.result_queue.qsize() < self.queued_data_points:
-                if self.query_parameters_queue is None:
-                    self.result_queue.put(self._get_tuple())
-                else:
-                    try:
-                        query_parameters = self.query_parameters_queue.get(block=True, timeout=0.001)
-                        self.result_queue.put(self._get_tuple(query_parameters))
-                    except Queue.Empty:
-                        pass
-                time.sleep(1.0)
+                except Queue.Full:
+                    if self._is_terminated():
+                        return
 
     def run(self):
+        # multiprocessing reseeds the random module in every forked collector but not numpy, without this all the
+        # collectors would draw the same joints and actions
+        np.random.seed()
         if self.init_trajectory_collector:
-            self.openrave_trajectory_generator = OpenraveTrajectoryGenerator(self.config)
+            self.openrave_trajectory_generator = OpenraveTrajectoryGenerator(self.config, self.planner_budget)
         if self.init_rl_interface:
             self.openrave_interface = OpenraveRLInterface(self.config)
         if self.params_file is not None:
@@ -64,7 +87,16 @@ class CollectorProcess(multiprocessing.Process):
 class DataCollector:
     def __init__(self, config, number_of_threads, params_file=None, query_parameters=None):
         self.number_of_threads = number_of_threads
-        self.results_queue = multiprocessing.Queue()
+        # the collectors block when the queue is full, so at most queue_size data points are waiting
+        self.batch_size = self._get_batch_size()
+        queue_size = self._get_queue_size(number_of_threads)
+        self.results_queue = multiprocessing.Queue(maxsize=max(1, queue_size / self.batch_size))
+        # data points that were received in a batch but not returned yet
+        self.pending_samples = []
+        # the trajectory collectors share a single planner budget
+        self.planner_budget = None
+        if 'openrave_planner' in config:
+            self.planner_budget = PlannerBudget.from_config(config)
         self.query_parameters_queue = None
         if query_parameters is not None:
             # put all the query parameters in the designated queue
@@ -75,10 +107,9 @@ class DataCollector:
             multiprocessing.JoinableQueue() for _ in range(self.number_of_threads)
         ]
 
-        queue_size = self._get_queue_size(number_of_threads)
         self.collectors = [
             self._get_collector(
-                copy.deepcopy(config), queue_size, self.collector_specific_queues[i], params_file
+                copy.deepcopy(config), self.batch_size, self.collector_specific_queues[i], params_file
             )
             for i in range(self.number_of_threads)
         ]
@@ -89,24 +120,29 @@ class DataCollector:
     def _get_queue_size(self, number_of_threads):
         pass
 
-    def _get_collector(self, config, queued_data_points, collector_specific_queue, params_file=None):
+    def _get_batch_size(self):
+        return 1
+
+    def _get_collector(self, config, batch_size, collector_specific_queue, params_file=None):
         pass
 
     def generate_samples(self, number_of_samples):
-        result_buffer = []
-        while number_of_samples:
-            number_of_samples -= 1
-            result_buffer.append(self.results_queue.get())
-
+        while len(self.pending_samples) < number_of_samples:
+            self.pending_samples.extend(self.results_queue.get())
+        result_buffer = self.pending_samples[:number_of_samples]
+        self.pending_samples = self.pending_samples[number_of_samples:]
         return result_buffer
 
     def end(self):
         message = (1, )
         self._post_private_message(message)
-        time.sleep(10)
         for c in self.collectors:
-            c.terminate()
-        time.sleep(10)
+            c.join(timeout=10)
+        # a collector that still has data in the results queue does not exit by itself
+        for c in self.collectors:
+            if c.is_alive():
+                c.terminate()
+            c.join()
 
     def _post_private_message(self, message):
         for collector_queue in self.collector_specific_queues:
@@ -50,7 +50,10 @@ def run_for_config(config, print_messages):
     # load images if required
     image_cache = None
     if _is_vision(scenario):
-        image_cache = ImageCache(config['general']['params_file'], create_images=True)
+        image_cache = ImageCache(
+            config['general']['params_file'], create_images=True, lazy=True,
+            max_loaded_items=config['general']['image_cache_size']
+        )
 
     # load pretrained model if required
     pre_trained_reward = None
@@ -69,24 +72,28 @@ def run_for_config(config, print_messages):
 
     def score_for_hindsight(augmented_buffer):
         assert _is_vision(scenario)
-        # unzip
-        goal_pose_list, goal_joints_list, workspace_image_list, current_state_list, action_used_list, _, is_goal_list,\
-        __ = zip(*augmented_buffer)
-        # make one hot status vector:
-        is_goal_one_hot_list = np.zeros((len(is_goal_list), 3), dtype=np.float32)
-        for i in range(len(is_goal_list)):
-            if is_goal_list[i]:
-                is_goal_one_hot_list[i, 2] = 1.0  # mark as goal transition
-            else:
-                is_goal_one_hot_list[i, 0] = 1.0  # mark as free transition
-        # unpack current and next state
-        current_joints, _, __ = unpack_state_batch(current_state_list)
-
-        fake_rewards, _ = pre_trained_reward.make_prediction(
-            sess, current_joints, goal_joints_list, action_used_list, goal_pose_list,
-            all_transition_labels=is_goal_one_hot_list
-        )
-        return list(fake_rewards)
+        # score in fixed size batches
+        batch_size = config['model']['batch_size']
+        fake_rewards = []
+        for batch_start in range(0, len(augmented_buffer), batch_size):
+            batch = augmented_buffer[batch_start: batch_start + batch_size]
+            # unzip
+            goal_pose_list, goal_joints_list, workspace_id_list, current_state_list, action_used_list, _, \
+            is_goal_list, __ = zip(*batch)
+            # make one hot status vector: goal transitions are marked 2, the rest are free transitions (0)
+            is_goal_one_hot_list = np.zeros((len(batch), 3), dtype=np.float32)
+            is_goal_one_hot_list[np.arange(len(batch)), np.where(is_goal_list, 2, 0)] = 1.0
+            # unpack current state
+            current_joints, _, __ = unpack_state_batch(current_state_list)
+            # get the images from the image cache
+            workspace_image_list = [image_cache.get_image(k) for k in workspace_id_list]
+
+            batch_rewards, _ = pre_trained_reward.make_prediction(
+                sess, current_joints, goal_joints_list, action_used_list, goal_pose_list,
+                all_transition_labels=is_goal_one_hot_list, images=workspace_image_list
+            )
+            fake_rewards.extend(batch_rewards)
+        return fake_rewards
 
     # initialize replay memory
     replay_buffer = ReplayBuffer(config)
@@ -107,7 +114,7 @@ def run_for_config(config, print_messages):
         gamma = config['model']['gamma']
         replay_buffer_batch = replay_buffer.sample_batch(batch_size)
 
-        goal_pose, goal_joints, workspace_id, current_state, action, reward, terminated, next_state = \
+        goal_pose, goal_joints, workspace_id, current_state, action, reward, terminated, next_state, discount = \
             replay_buffer_batch
 
         # get image from image cache
@@ -123,9 +130,9 @@ def run_for_config(config, print_messages):
             next_joints, workspace_image, goal_pose, goal_joints, sess, use_online_network=False
         )
 
-        # compute critic label
+        # compute critic label (the discount of every transition depends on the number of steps it spans)
         q_label = np.expand_dims(np.squeeze(np.array(reward)) + np.multiply(
-            np.multiply(1 - np.array(terminated), gamma),
+            np.multiply(1 - np.array(terminated), np.array(discount)),
             np.squeeze(next_state_action_target_q)
         ), 1)
         max_label = np.max(q_label)
@@ -182,7 +189,7 @@ def run_for_config(config, print_messages):
         return status, states, actions, rewards, goal_pose, goal_joints, workspace_id
 
     def do_test(sess, best_model_global_step, best_model_test_success_rate):
-        rollout_manager.set_policy_weights(network.get_actor_weights(sess, is_online=False), is_online=False)
+        rollout_manager.set_policy_weights(network.get_actor_flat_weights(sess, is_online=False), is_online=False)
         eval_result = trajectory_eval.eval(global_step, config['test']['number_of_episodes'])
         test_episodes = eval_result[0]
         test_successful_episodes = eval_result[1]
@@ -218,7 +225,7 @@ def run_for_config(config, print_messages):
         # restores the model first
         best_saver.restore(sess, best_model_path)
         # set the weights
-        rollout_manager.set_policy_weights(network.get_actor_weights(sess, is_online=False), is_online=False)
+        rollout_manager.set_policy_weights(network.get_actor_flat_weights(sess, is_online=False), is_online=False)
         eval_result = trajectory_eval.eval(-1, config['validation']['number_of_episodes'])
         test_episodes = eval_result[0]
         test_successful_episodes = eval_result[1]
@@ -237,8 +244,12 @@ def run_for_config(config, print_messages):
         return rate
 
     allowed_batch_episode_editor = config['model']['batch_size'] if _is_vision(scenario) else None
+    # the train episodes are either altered by the actors or here
+    alter_episode_in_actors = pre_trained_reward is not None and config['model']['alter_episode_in_actors'] and \
+                              config['model']['alter_episode'] != 0
     regular_episode_editor = EpisodeEditor(
-        config['model']['alter_episode'], pre_trained_reward, image_cache=image_cache,
+        0 if alter_episode_in_actors else config['model']['alter_episode'], pre_trained_reward,
+        image_cache=image_cache,
         allowed_batch=allowed_batch_episode_editor
     )
     motion_planner_episode_editor = EpisodeEditor(
@@ -253,6 +264,8 @@ def run_for_config(config, print_messages):
         sess.run(tf.global_variables_initializer())
         if pre_trained_reward is not None:
             pre_trained_reward.load_weights(sess)
+            if alter_episode_in_actors:
+                rollout_manager.set_reward_weights(pre_trained_reward.get_weights(sess))
         network.update_target_networks(sess)
 
         global_step = 0
@@ -261,7 +274,7 @@ def run_for_config(config, print_messages):
         for update_index in range(config['general']['updates_cycle_count']):
             # collect data
             a = datetime.datetime.now()
-            rollout_manager.set_policy_weights(network.get_actor_weights(sess, is_online=True), is_online=True)
+            rollout_manager.set_policy_weights(network.get_actor_flat_weights(sess, is_online=True), is_online=True)
             episodes_per_update = config['general']['episodes_per_update']
             episode_results = rollout_manager.generate_episodes(episodes_per_update, True)
             episodes_agent_trajectory, episodes_times, episodes_example_trajectory = zip(*episode_results)
@@ -339,12 +352,17 @@ def run_for_config(config, print_messages):
                 if is_best:
                     best_model_path = best_saver.save(sess, os.path.join(saver_dir, 'best'), global_step=global_step)
             if update_index % config['general']['save_model_every_cycles'] == 0:
+                # the transitions scored in the background are added before the model is saved
+                hindsight_policy.wait_for_scoring()
                 latest_saver.save(sess, os.path.join(saver_dir, 'last_iteration'), global_step=global_step)
             # see if max score reached (even if validation is not 100%, there will no longer be any model updates...)
             if best_model_test_success_rate > 0.99999:
                 print 'stoping run: best test success rate reached {}'.format(best_model_test_success_rate)
                 break
 
+        # add the last transitions scored in the background
+        hindsight_policy.wait_for_scoring()
+
         # final test at the end
         is_best, best_model_global_step, best_model_test_success_rate = do_test(
             sess, best_model_global_step, best_model_test_success_rate)
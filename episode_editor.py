@@ -18,51 +18,66 @@ class EpisodeEditor:
         self.actions_buffer = None
         self.goal_poses_buffer = None
         self.status_buffer = None
+        # every distinct workspace image is kept once, the rows reference it by index
         self.images_buffer = None
+        self.image_indices_buffer = None
 
-    def _clear_buffers(self):
-        self.current_joints_buffer = np.zeros((0, self.joints_dimension), dtype=np.float32)
-        self.goal_joints_buffer = np.zeros((0, self.joints_dimension), dtype=np.float32)
-        self.actions_buffer = np.zeros((0, self.joints_dimension), dtype=np.float32)
-        self.goal_poses_buffer = np.zeros((0, self.pose_dimension), dtype=np.float32)
+    def _allocate_buffers(self, transitions_count, images_count):
+        self.current_joints_buffer = np.zeros((transitions_count, self.joints_dimension), dtype=np.float32)
+        self.goal_joints_buffer = np.zeros((transitions_count, self.joints_dimension), dtype=np.float32)
+        self.actions_buffer = np.zeros((transitions_count, self.joints_dimension), dtype=np.float32)
+        self.goal_poses_buffer = np.zeros((transitions_count, self.pose_dimension), dtype=np.float32)
+        self.status_buffer = None
         if self.alter_episode_mode == 2:
-            self.status_buffer = np.zeros((0, self.status_dimension), dtype=np.float32)
+            self.status_buffer = np.zeros((transitions_count, self.status_dimension), dtype=np.float32)
+        self.images_buffer = None
+        self.image_indices_buffer = None
         if self.image_cache is not None:
-            self.images_buffer = np.zeros((0, self.image_dimension[0], self.image_dimension[1]), dtype=np.int32)
+            self.images_buffer = np.zeros((images_count, self.image_dimension[0], self.image_dimension[1]),
+                                          dtype=np.float32)
+            self.image_indices_buffer = np.zeros((transitions_count, ), dtype=np.int32)
 
-    def _append_to_buffers(self, current_joints, goal_joints, actions, goal_poses, status, images):
-        self.current_joints_buffer = np.append(self.current_joints_buffer, current_joints, axis=0)
-        self.goal_joints_buffer = np.append(self.goal_joints_buffer, goal_joints, axis=0)
-        self.actions_buffer = np.append(self.actions_buffer, actions, axis=0)
-        self.goal_poses_buffer = np.append(self.goal_poses_buffer, goal_poses, axis=0)
-        if self.status_buffer is not None:
-            self.status_buffer = np.append(self.status_buffer, status, axis=0)
-        if self.images_buffer is not None:
-            self.images_buffer = np.append(self.images_buffer, images, axis=0)
+    def _fill_buffers(self, episodes):
+        # returns the start index of every episode in the buffers
+        episode_start_indices = []
+        image_index_by_workspace = {}
+        current_index = 0
+        for episode_agent_trajectory in episodes:
+            status, states, actions, rewards, goal_pose, goal_joints, workspace_id = episode_agent_trajectory
+            episode_start_indices.append(current_index)
+            end_index = current_index + len(actions)
+            self.current_joints_buffer[current_index:end_index] = [state[0] for state in states[:-1]]
+            self.goal_joints_buffer[current_index:end_index] = goal_joints
+            self.actions_buffer[current_index:end_index] = actions
+            self.goal_poses_buffer[current_index:end_index] = goal_pose
+            if self.status_buffer is not None and len(actions) > 0:
+                self.status_buffer[current_index:end_index - 1, 0] = 1.0
+                self.status_buffer[end_index - 1, 2] = 1.0
+            if self.images_buffer is not None:
+                if workspace_id not in image_index_by_workspace:
+                    image_index = len(image_index_by_workspace)
+                    image_index_by_workspace[workspace_id] = image_index
+                    self.images_buffer[image_index] = self.image_cache.get_image(workspace_id)
+                self.image_indices_buffer[current_index:end_index] = image_index_by_workspace[workspace_id]
+            current_index = end_index
+        return episode_start_indices
 
     def _predict_buffers_by_batches(self, sess):
-        if self.allowed_batch is None:
-            # predict for all the episodes in the same time
-            return self.pre_trained_reward.make_prediction(
-                sess, self.current_joints_buffer, self.goal_joints_buffer, self.actions_buffer, self.goal_poses_buffer,
-                self.status_buffer, images=self.images_buffer
-            )
-        current_index = 0
-        fake_rewards = np.zeros((0, 1), dtype=np.float32)
-        fake_status_prob = np.zeros((0, self.status_dimension), dtype=np.float32)
-        while current_index < len(self.current_joints_buffer):
+        transitions_count = len(self.current_joints_buffer)
+        batch_size = transitions_count if self.allowed_batch is None else self.allowed_batch
+        fake_rewards = np.zeros((transitions_count, 1), dtype=np.float32)
+        fake_status_prob = np.zeros((transitions_count, self.status_dimension), dtype=np.float32)
+        for current_index in range(0, transitions_count, max(batch_size, 1)):
+            batch = slice(current_index, current_index + batch_size)
+            status = None if self.status_buffer is None else self.status_buffer[batch]
+            # the images of the batch are gathered only when needed
+            images = None if self.images_buffer is None else self.images_buffer[self.image_indices_buffer[batch]]
             current_prediction_result = self.pre_trained_reward.make_prediction(
-                sess,
-                self.current_joints_buffer[current_index: current_index + self.allowed_batch],
-                self.goal_joints_buffer[current_index: current_index + self.allowed_batch],
-                self.actions_buffer[current_index: current_index + self.allowed_batch],
-                self.goal_poses_buffer[current_index: current_index + self.allowed_batch],
-                self.status_buffer[current_index: current_index + self.allowed_batch],
-                images=self.images_buffer[current_index: current_index + self.allowed_batch]
+                sess, self.current_joints_buffer[batch], self.goal_joints_buffer[batch], self.actions_buffer[batch],
+                self.goal_poses_buffer[batch], status, images=images
             )
-            current_index += self.allowed_batch
-            fake_rewards = np.append(fake_rewards, current_prediction_result[0], axis=0)
-            fake_status_prob = np.append(fake_status_prob, current_prediction_result[1], axis=0)
+            fake_rewards[batch] = current_prediction_result[0]
+            fake_status_prob[batch] = current_prediction_result[1]
         return fake_rewards, fake_status_prob
 
     def process_episodes(self, episodes, sess):
@@ -70,26 +85,11 @@ class EpisodeEditor:
         if self.alter_episode_mode == 0:
             return episodes
         assert self.pre_trained_reward is not None
-        # clear reward network input buffers
-        self._clear_buffers()
-        episode_start_indices = []
-        for episode_agent_trajectory in episodes:
-            # save the start index for every episode
-            episode_start_indices.append(len(self.current_joints_buffer))
-            # add data to buffers
-            status, states, actions, rewards, goal_pose, goal_joints, workspace_id = episode_agent_trajectory
-            current_joints = [state[0] for state in states[:-1]]
-            one_hot_status = None
-            if self.alter_episode_mode == 2:
-                one_hot_status = np.zeros((len(rewards), 3), dtype=np.float32)
-                one_hot_status[:-1, 0] = 1.0
-                one_hot_status[-1, 2] = 1.0
-            images = None
-            if self.images_buffer is not None:
-                image = self.image_cache.get_image(workspace_id)
-                images = [image] * len(actions)
-            self._append_to_buffers(current_joints, [goal_joints] * len(actions), actions, [goal_pose] * len(actions),
-                                    one_hot_status, images)
+        # size the reward network input buffers once
+        transitions_count = sum([len(episode_agent_trajectory[2]) for episode_agent_trajectory in episodes])
+        images_count = len(set([episode_agent_trajectory[-1] for episode_agent_trajectory in episodes]))
+        self._allocate_buffers(transitions_count, images_count)
+        episode_start_indices = self._fill_buffers(episodes)
         # get the results by batch:
         fake_rewards, fake_status_prob = self._predict_buffers_by_batches(sess)
 
@@ -1,20 +1,36 @@
-import time
+import sys
+import json
 import datetime
 import yaml
 import os
 import multiprocessing
 import Queue
+import cPickle as pickle
 
+from image_rasterizer import rasterize_workspace
+from occupancy_grid import build_occupancy_grid
 from openrave_manager import OpenraveManager
 from potential_point import PotentialPoint
 from workspace_generation_utils import *
 
+# generates workspaces in which random challenging trajectories (start and goal on both sides of an obstacle) can be
+# planned often enough. every accepted workspace is streamed to the output directory as soon as it is found: the params
+# ('<id>_workspace.pkl'), the rendered image ('<id>_workspace.image_pkl', reused by ImageCache) and a line of statistics
+# in 'statistics.jsonl'.
+
 number_of_workspaces = 10
 number_of_workers = 2
 test_trajectories = 100
 attempts_to_find_single_trajectory = 100
 trajectories_required_to_pass = 5
 planner_iterations = 150
+# build the occupancy grids of the workspaces found after the generation ends (every grid takes 24^4 exact checks on all
+# the cores, see occupancy_grid.py). off by default, as the grids are off by default (openrave_rl.use_occupancy_grid)
+build_occupancy_grids = False
+# a workspace is rejected early by a sequential probability ratio test, between the success rate required to pass and a
+# hopeless success rate (a fraction of the required rate), with the same error probability for both decisions
+hopeless_success_rate_ratio = 0.25
+sequential_test_error = 0.05
 
 # number_of_workspaces = 1000
 # number_of_workers = 72
@@ -24,107 +40,177 @@ planner_iterations = 150
 # planner_iterations = 1500
 
 output_dir = 'vision_workspaces'
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+statistics_filename = 'statistics.jsonl'
+
+
+class SequentialTest:
+    # wald's sequential probability ratio test of the success rate: is it the passing rate or the hopeless rate
+    def __init__(self, passing_success_rate, hopeless_success_rate, error_probability):
+        self.success_step = np.log(passing_success_rate / hopeless_success_rate)
+        self.failure_step = np.log((1.0 - passing_success_rate) / (1.0 - hopeless_success_rate))
+        self.hopeless_threshold = np.log(error_probability / (1.0 - error_probability))
+        self.log_likelihood_ratio = 0.0
+
+    def add(self, is_successful):
+        self.log_likelihood_ratio += self.success_step if is_successful else self.failure_step
+
+    def is_hopeless(self):
+        return self.log_likelihood_ratio <= self.hopeless_threshold
 
 
 class WorkerQueue(multiprocessing.Process):
     def __init__(self, test_trajectories, attempts_to_find_single_trajectory, trajectories_required_to_pass,
-                 planner_iterations, workspace_generation_queue, worker_specific_queue, results_queue):
+                 planner_iterations, output_dir, workspace_generation_queue, worker_specific_queue, results_queue):
         multiprocessing.Process.__init__(self)
         # parameters
         self.test_trajectories = test_trajectories
         self.attempts_to_find_single_trajectory = attempts_to_find_single_trajectory
         self.trajectories_required_to_pass = trajectories_required_to_pass
         self.planner_iterations = planner_iterations
+        self.output_dir = output_dir
         # queues
         self.workspace_generation_queue = workspace_generation_queue
         self.worker_specific_queue = worker_specific_queue
         self.results_queue = results_queue
         # members
-        self.generator = WorkspaceGenerator(obstacle_count_probabilities={2: 0.05, 3: 0.5, 4: 0.4, 5: 0.05})
+        self.generator = WorkspaceGenerator(
+            print_info=False, obstacle_count_probabilities={2: 0.05, 3: 0.5, 4: 0.4, 5: 0.05})
         config_path = os.path.join(os.getcwd(), 'config/config.yml')
         with open(config_path, 'r') as yml_file:
             self.config = yaml.load(yml_file)
+        # created once in the worker process (see run), every candidate workspace only replaces the obstacles
         self.openrave_manager = None
-
-    def _is_below_goal_sensitivity(self, start_pose, goal_pose):
-        pose_distance = np.linalg.norm(np.array(start_pose) - np.array(goal_pose))
-        return pose_distance < self.config['openrave_rl']['goal_sensitivity']
+        # start and goal pairs that passed the screening, for the current candidate workspace
+        self.candidates = []
+        # candidate workspaces are generated in batches
+        self.candidate_workspaces = None
+        self.candidate_workspaces_batch_size = 1000
 
     @staticmethod
-    def _is_challenging(start_pose, goal_pose, workspace_params):
-        start = np.array(start_pose)
-        goal = np.array(goal_pose)
-        start_goal_distance = np.linalg.norm(start - goal)
-        for i in range(workspace_params.number_of_obstacles):
-            obstacle = np.array(
-                [workspace_params.centers_position_x[i], workspace_params.centers_position_z[i]]
-            )
-            start_obstacle_distance = np.linalg.norm(start - obstacle)
-            goal_obstacle_distance = np.linalg.norm(goal - obstacle)
-            if start_obstacle_distance < start_goal_distance and goal_obstacle_distance < start_goal_distance:
-                return True
-        # all tests failed
-        return False
-
-    def _try_plan(self, workspace_params, openrave_manager):
-        for i in range(self.attempts_to_find_single_trajectory):
-            # select at random
-            start_joints = openrave_manager.get_random_joints({0: 0.0})
-            goal_joints = openrave_manager.get_random_joints({0: 0.0})
-            start_pose = openrave_manager.get_target_pose(start_joints)
-            goal_pose = openrave_manager.get_target_pose(goal_joints)
-            # if the start and goal are too close, re-sample
-            if self._is_below_goal_sensitivity(start_joints, goal_joints):
-                continue
-            # valid region:
-            if not start_pose[1] < 0.0 or goal_pose[1] < 0.0:
-                continue
-            # trajectories that must cross an obstacle
-            if self._is_challenging(start_pose, goal_pose, workspace_params):
-                continue
-            traj = openrave_manager.plan(start_joints, goal_joints, self.planner_iterations)
-            return traj is not None
-        return None
+    def _are_challenging(start_poses, goal_poses, start_goal_distances, workspace_params):
+        # check if the distance of the start and the goal from any obstacle is smaller that the start-goal-distance
+        obstacles = np.array([workspace_params.centers_position_x, workspace_params.centers_position_z]).transpose()
+        start_obstacle_distances = np.linalg.norm(start_poses[:, None, :] - obstacles[None, :, :], axis=2)
+        goal_obstacle_distances = np.linalg.norm(goal_poses[:, None, :] - obstacles[None, :, :], axis=2)
+        start_goal_distances = start_goal_distances[:, None]
+        return np.any(np.logical_and(
+            start_obstacle_distances < start_goal_distances, goal_obstacle_distances < start_goal_distances
+        ), axis=1)
+
+    def _get_candidates(self, workspace_params):
+        # screens all the attempts of a single trajectory together
+        openrave_manager = self.openrave_manager
+        start_joints = openrave_manager.get_random_joints_batch(self.attempts_to_find_single_trajectory, {0: 0.0})
+        goal_joints = openrave_manager.get_random_joints_batch(self.attempts_to_find_single_trajectory, {0: 0.0})
+        start_poses = openrave_manager.get_target_poses(start_joints)
+        goal_poses = openrave_manager.get_target_poses(goal_joints)
+        start_goal_distances = np.linalg.norm(start_poses - goal_poses, axis=1)
+        # if the start and goal are too close, re-sample
+        is_candidate = start_goal_distances >= self.config['openrave_rl']['goal_sensitivity']
+        # valid region:
+        is_candidate &= np.logical_and(start_poses[:, 1] > 0.0, goal_poses[:, 1] > 0.0)
+        # trajectories that must cross an obstacle
+        is_candidate &= self._are_challenging(start_poses, goal_poses, start_goal_distances, workspace_params)
+        return [(tuple(start_joints[i]), tuple(goal_joints[i])) for i in np.where(is_candidate)[0]]
+
+    def _try_plan(self, workspace_params):
+        # returns None if no challenging start and goal were found in all the attempts
+        if len(self.candidates) == 0:
+            self.candidates = self._get_candidates(workspace_params)
+            if len(self.candidates) == 0:
+                return None
+        start_joints, goal_joints = self.candidates.pop()
+        traj = self.openrave_manager.plan(start_joints, goal_joints, self.planner_iterations)
+        return traj is not None
+
+    def _load_workspace(self, workspace_params):
+        self.openrave_manager.remove_objects()
+        self.openrave_manager.load_params(workspace_params, None)
+        self.candidates = []
+
+    def _test_workspace(self, workspace_params):
+        # returns if the workspace passed, and the statistics of the test
+        self._load_workspace(workspace_params)
+        passing_success_rate = float(self.trajectories_required_to_pass) / self.test_trajectories
+        sequential_test = SequentialTest(
+            passing_success_rate, passing_success_rate * hopeless_success_rate_ratio, sequential_test_error)
+        statistics = {'trajectories_tried': 0, 'successful_trajectories': 0, 'no_challenging_trajectory': 0}
+        for i in range(self.test_trajectories):
+            # see if there is hope
+            trajectories_left = self.test_trajectories - i
+            if trajectories_left + statistics['successful_trajectories'] < self.trajectories_required_to_pass:
+                statistics['rejected_by'] = 'required_ratio'
+                return False, statistics
+            if sequential_test.is_hopeless():
+                statistics['rejected_by'] = 'sequential_test'
+                return False, statistics
+            # try a trajectory
+            is_successful = self._try_plan(workspace_params)
+            statistics['trajectories_tried'] += 1
+            if is_successful is None:
+                statistics['no_challenging_trajectory'] += 1
+            statistics['successful_trajectories'] += is_successful is True
+            sequential_test.add(is_successful is True)
+            # if successful update the status
+            if statistics['successful_trajectories'] >= self.trajectories_required_to_pass:
+                return True, statistics
+        statistics['rejected_by'] = 'required_ratio'
+        return False, statistics
+
+    def _save_workspace(self, workspace_id, workspace_params):
+        save_path = os.path.join(self.output_dir, '{}_workspace.pkl'.format(workspace_id))
+        workspace_params.save(save_path)
+        # the image is rendered from the params as loaded by the other modules (load_from_file shrinks the obstacles)
+        image = rasterize_workspace(WorkspaceParams.load_from_file(save_path))
+        with open(save_path.replace('.pkl', '.image_pkl'), 'w') as image_file:
+            pickle.dump(image, image_file)
+        return save_path
+
+    def _next_candidate_workspace(self):
+        if self.candidate_workspaces is None or len(self.candidate_workspaces) == 0:
+            self.candidate_workspaces = self.generator.generate_workspaces(self.candidate_workspaces_batch_size)
+        workspace_params = self.candidate_workspaces.get_workspace_params(0)
+        self.candidate_workspaces = self.candidate_workspaces.select(slice(1, None))
+        return workspace_params
 
     def _generate_single_workspace(self, workspace_id):
+        start_time = datetime.datetime.now()
+        rejected = {'required_ratio': 0, 'sequential_test': 0}
+        rejected_trajectories_tried = 0
         while True:
             a = datetime.datetime.now()
-            workspace_params = self.generator.generate_workspace()
-            self.openrave_manager = OpenraveManager(self.config['openrave_rl']['segment_validity_step'],
-                                                    PotentialPoint.from_config(self.config))
-            self.openrave_manager.loaded_params_path = None
-            self.openrave_manager.load_params(workspace_params, '')
-            successful_trajectories_count = 0
-            i = 0
-            for i in range(self.test_trajectories):
-                # see if there is hope
-                trajectories_left = self.test_trajectories - i
-                if trajectories_left + successful_trajectories_count < self.trajectories_required_to_pass:
-                    print 'no hope to get the required ratio'
-                    break
-                # try a trajectory
-                successful_trajectories_count += self._try_plan(workspace_params, self.openrave_manager) is not None
-                # if successful update the status
-                if successful_trajectories_count >= self.trajectories_required_to_pass:
-                    print 'workspace found'
-                    save_path = os.path.join(output_dir, '{}_workspace.pkl'.format(workspace_id))
-                    workspace_params.save(save_path)
-                    return
+            workspace_params = self._next_candidate_workspace()
+            is_passed, statistics = self._test_workspace(workspace_params)
             b = datetime.datetime.now()
-            print 'trajectories tried {}'.format(i)
-            print 'success count {}'.format(successful_trajectories_count)
-            print 'time since start {}'.format(b - a)
-            print ''
+            if is_passed:
+                break
+            rejected[statistics['rejected_by']] += 1
+            rejected_trajectories_tried += statistics['trajectories_tried']
+            print 'workspace rejected by {} after {} trajectories ({} successful) in {}'.format(
+                statistics['rejected_by'], statistics['trajectories_tried'], statistics['successful_trajectories'],
+                b - a)
+        save_path = self._save_workspace(workspace_id, workspace_params)
+        statistics.update({
+            'workspace_id': os.path.basename(save_path),
+            'number_of_obstacles': int(workspace_params.number_of_obstacles),
+            'test_time': (b - a).total_seconds(),
+            'rejected_workspaces': rejected,
+            'rejected_trajectories_tried': rejected_trajectories_tried,
+            'total_time': (b - start_time).total_seconds(),
+        })
+        return statistics
 
     def run(self):
+        # the forked workers would otherwise generate the same workspaces
+        np.random.seed()
+        self.openrave_manager = OpenraveManager(
+            self.config['openrave_rl']['segment_validity_step'], PotentialPoint.from_config(self.config))
         while True:
             try:
                 # wait 1 second for a workspace generation request
                 workspace_id = self.workspace_generation_queue.get(block=True, timeout=1)
-                self._generate_single_workspace(workspace_id)
-                self.results_queue.put(workspace_id)
+                statistics = self._generate_single_workspace(workspace_id)
+                self.results_queue.put((workspace_id, statistics))
                 self.workspace_generation_queue.task_done()
             except Queue.Empty:
                 pass
@@ -136,30 +222,63 @@ class WorkerQueue(multiprocessing.Process):
             except Queue.Empty:
                 pass
 
-# set the queues
-workers_specific_queues = [multiprocessing.JoinableQueue() for _ in range(number_of_workers)]
-requests_queue = multiprocessing.JoinableQueue()
-results_queue = multiprocessing.Queue()
-# init the workers
-workers = [WorkerQueue(test_trajectories, attempts_to_find_single_trajectory, trajectories_required_to_pass,
-                       planner_iterations, requests_queue, workers_specific_queues[i], results_queue)
-           for i in range(number_of_workers)]
-# run the workers
-for w in workers:
-    w.start()
-
-global_start_time = datetime.datetime.now()
-# set generate workspaces request
-for workspace_id in range(number_of_workspaces):
-    requests_queue.put(workspace_id)
-# wait for them
-for i in range(number_of_workspaces):
-    workspace_id = results_queue.get()
-    current_time = datetime.datetime.now()
-    print 'workspace {} found'.format(workspace_id)
-    print 'time from start {}'.format(current_time - global_start_time)
-    print ''
-# close all workers
-for queue in workers_specific_queues:
-    queue.put(None)
-time.sleep(10)
+
+def generate_workspaces(output_dir, number_of_workspaces, number_of_workers, first_workspace_id=0,
+                        build_occupancy_grids=False):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # set the queues
+    workers_specific_queues = [multiprocessing.JoinableQueue() for _ in range(number_of_workers)]
+    requests_queue = multiprocessing.JoinableQueue()
+    results_queue = multiprocessing.Queue()
+    # init the workers
+    workers = [WorkerQueue(test_trajectories, attempts_to_find_single_trajectory, trajectories_required_to_pass,
+                           planner_iterations, output_dir, requests_queue, workers_specific_queues[i], results_queue)
+               for i in range(number_of_workers)]
+    # run the workers
+    for w in workers:
+        w.start()
+
+    global_start_time = datetime.datetime.now()
+    # set generate workspaces request
+    for workspace_id in range(first_workspace_id, first_workspace_id + number_of_workspaces):
+        requests_queue.put(workspace_id)
+    # wait for them, the statistics are appended as the workspaces are found
+    found_workspace_ids = []
+    with open(os.path.join(output_dir, statistics_filename), 'a') as statistics_file:
+        for i in range(number_of_workspaces):
+            workspace_id, statistics = results_queue.get()
+            current_time = datetime.datetime.now()
+            statistics_file.write(json.dumps(statistics, sort_keys=True) + '\n')
+            statistics_file.flush()
+            print 'workspace {} found ({} of {}), rejected {}'.format(
+                workspace_id, i + 1, number_of_workspaces, statistics['rejected_workspaces'])
+            print 'time from start {}'.format(current_time - global_start_time)
+            print ''
+            found_workspace_ids.append(workspace_id)
+    # close all workers
+    for queue in workers_specific_queues:
+        queue.put(None)
+    for w in workers:
+        w.join(timeout=10)
+    # the grids are built once the cores are free
+    if build_occupancy_grids:
+        for workspace_id in found_workspace_ids:
+            build_occupancy_grid(os.path.join(output_dir, '{}_workspace.pkl'.format(workspace_id)))
+
+
+if __name__ == '__main__':
+    # usage: python generate_challenging_workspaces.py [--occupancy-grids] [output_dir [number_of_workspaces
+    # [number_of_workers [first_workspace_id]]]]
+    arguments = [argument for argument in sys.argv[1:] if argument != '--occupancy-grids']
+    if len(arguments) < len(sys.argv) - 1:
+        build_occupancy_grids = True
+    if len(arguments) > 0:
+        output_dir = os.path.expanduser(arguments[0])
+    if len(arguments) > 1:
+        number_of_workspaces = int(arguments[1])
+    if len(arguments) > 2:
+        number_of_workers = int(arguments[2])
+    first_workspace_id = int(arguments[3]) if len(arguments) > 3 else 0
+    generate_workspaces(
+        output_dir, number_of_workspaces, number_of_workers, first_workspace_id, build_occupancy_grids)
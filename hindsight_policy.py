@@ -1,4 +1,6 @@
+import sys
 import numpy as np
+import threading
 from potential_point import PotentialPoint
 
 
@@ -8,27 +10,72 @@ class HindsightPolicy:
         self.replay_buffer = replay_buffer
         self.target_potential_point = PotentialPoint.from_config(config)[-1]
         self.predict_reward_and_status_func = predict_reward_and_status_func
+        self.gamma = config['model']['gamma']
+        self.n_step = config['model']['n_step']
         # the following buffer saves the transition we are about to add
         self.augmented_buffer = []
+        # scoring with the reward model runs in the background, the results are added in the next call (or by
+        # wait_for_scoring). the scoring overlaps the model updates and the collection of the next episodes, so the
+        # reward model and the image cache are used from two threads at once
+        self._scoring_thread = None
+        self._scoring_results = None
 
     def append_to_replay_buffer(self, episodes):
+        # first add the transitions that were scored while the current episodes were collected
+        self.wait_for_scoring()
         self.augmented_buffer = []
         for episode in episodes:
             self._append_to_replay_buffer_single_episode(episode)
         self._score_extra_data_and_add_to_buffer()
 
+    def wait_for_scoring(self):
+        if self._scoring_thread is None:
+            return
+        self._scoring_thread.join()
+        self._scoring_thread = None
+        augmented_buffer, rewards, exc_info = self._scoring_results
+        self._scoring_results = None
+        # the scoring failed, raise the error in the calling thread with the traceback of the scoring thread
+        if exc_info is not None:
+            exc_type, exc_value, exc_tb = exc_info
+            raise exc_type, exc_value, exc_tb
+        self._add_augmented_buffer(augmented_buffer, rewards)
+
+    def _score_in_background(self, augmented_buffer):
+        try:
+            self._scoring_results = (augmented_buffer, self.predict_reward_and_status_func(augmented_buffer), None)
+        except Exception:
+            self._scoring_results = (augmented_buffer, None, sys.exc_info())
+
+    def _add_augmented_buffer(self, augmented_buffer, rewards=None):
+        for i, transition in enumerate(augmented_buffer):
+            goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal, \
+            next_state = transition
+            if rewards is not None:
+                current_reward = rewards[i]
+            self.replay_buffer.add(
+                goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal,
+                next_state, self.gamma
+            )
+
     def _append_to_replay_buffer_single_episode(self, episode):
         status, states, actions, rewards, goal_pose, goal_joints, workspace_id = episode
+        # discounted partial sums of the rewards, the n-step reward from i is (returns[i] - returns[i+n]) / gamma^i
+        discounts = np.power(self.gamma, np.arange(len(actions) + 1))
+        returns = np.append(np.cumsum((np.ravel(rewards) * discounts[:-1])[::-1])[::-1], 0.0)
         for i in range(len(actions)):
+            # the transition spans n steps, unless the episode ends before that
+            steps = min(self.n_step, len(actions) - i)
             current_state = states[i]
-            next_state = states[i+1]
+            next_state = states[i + steps]
             action_used = actions[i]
-            current_reward = rewards[i]
-            # only the last state is a terminal state
-            is_terminal = i == len(actions) - 1 and status != 1
+            current_reward = (returns[i] - returns[i + steps]) / discounts[i]
+            # only the last state is a terminal state, an episode that ended free (status 1) was truncated and the
+            # value of its last state should still be bootstrapped
+            is_terminal = i + steps == len(actions) and status != 1
             self.replay_buffer.add(
                 goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal,
-                next_state
+                next_state, discounts[steps]
             )
             self._add_extra_data(i, status, states, actions, rewards, workspace_id)
 
@@ -36,24 +83,10 @@ class HindsightPolicy:
         if len(self.augmented_buffer) == 0:
             return
         if self.config['hindsight']['score_with_reward_model']:
-            rewards = self.predict_reward_and_status_func(self.augmented_buffer)
-            for i, transition in enumerate(self.augmented_buffer):
-                goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal, \
-                next_state = transition
-                self.replay_buffer.add(
-                    goal_pose, goal_joints, workspace_id, current_state, action_used, rewards[i], is_terminal,
-                    next_state
-                )
+            self._scoring_thread = threading.Thread(target=self._score_in_background, args=(self.augmented_buffer, ))
+            self._scoring_thread.start()
         else:
-            for transition in self.augmented_buffer:
-                goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal, \
-                next_state = transition
-                self.replay_buffer.add(
-                    goal_pose, goal_joints, workspace_id, current_state, action_used, current_reward, is_terminal,
-                    next_state
-                )
-            # for transition in self.augmented_buffer:
-            #     self.replay_buffer.add(*zip(transition))
+            self._add_augmented_buffer(self.augmented_buffer)
 
     def _add_extra_data(self, current_state_index, status, states, actions, rewards, workspace_id):
         if not self.config['hindsight']['enable']:
@@ -1,9 +1,12 @@
-from PIL import Image
-import matplotlib.pyplot as plt
 import os
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict
 import numpy as np
 import cPickle as pickle
 
+from image_rasterizer import rasterize_workspace
 from workspace_generation_utils import WorkspaceParams
 
 
@@ -15,29 +18,136 @@ class ImageCacheItem:
         self.np_array = np_array
 
 
+class LazyImageCacheItems:
+    # a read only mapping from workspace id to ImageCacheItem, the items are loaded on first access and at most
+    # max_loaded_items are kept (least recently used are dropped). the items are accessed from more than one thread (the
+    # hindsight scoring runs in the background, see HindsightPolicy), so the loaded items are guarded by a lock
+    def __init__(self, source_dir, filenames, archive_rows, max_loaded_items=None):
+        self.source_dir = source_dir
+        self.filenames = filenames
+        self.archive_rows = archive_rows
+        self.max_loaded_items = max_loaded_items
+        self._archive = None
+        self._loaded_items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # only the index is sent to other processes, the items are loaded again on demand
+        state = self.__dict__.copy()
+        state['_archive'] = None
+        state['_loaded_items'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_archive(self):
+        if self._archive is None:
+            self._archive, _ = ImageCache.load_image_archive(self.source_dir)
+        return self._archive
+
+    def __getitem__(self, workspace_id):
+        with self._lock:
+            return self._get_item(workspace_id)
+
+    def _get_item(self, workspace_id):
+        if workspace_id in self._loaded_items:
+            # mark as recently used
+            item = self._loaded_items.pop(workspace_id)
+            self._loaded_items[workspace_id] = item
+            return item
+        if workspace_id not in self.archive_rows:
+            raise KeyError(workspace_id)
+        full_file_path = os.path.join(self.source_dir, workspace_id)
+        params = WorkspaceParams.load_from_file(full_file_path)
+        row = self.archive_rows[workspace_id]
+        # a view into the memory mapped archive
+        np_array = None if row is None else self._get_archive()[row]
+        item = ImageCacheItem(workspace_id, full_file_path, params, np_array)
+        self._loaded_items[workspace_id] = item
+        if self.max_loaded_items is not None and len(self._loaded_items) > self.max_loaded_items:
+            self._loaded_items.popitem(last=False)
+        return item
+
+    def __contains__(self, workspace_id):
+        return workspace_id in self.archive_rows
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    def keys(self):
+        return list(self.filenames)
+
+    def values(self):
+        return [self[workspace_id] for workspace_id in self.filenames]
+
+
 class ImageCache:
-    def __init__(self, params_directory, create_images=True):
-        self.items = {}
+    # all the workspace images are kept in a single uint8 archive in the params directory, with an index of the
+    # workspace ids (one per line, in the same order). the first line of the index is the name of the archive, every
+    # archive gets a new name so replacing the index replaces both at once
+    archive_prefix = 'images_'
+    index_filename = 'images_index.txt'
+
+    def __init__(self, params_directory, create_images=True, lazy=False, max_loaded_items=None):
         self._create_images = create_images
 
         source_dir = os.path.expanduser(params_directory)
-        for dirpath, dirnames, filenames in os.walk(source_dir):
-            for filename in filenames:
-                if not filename.endswith('.pkl'):
-                    continue
-                full_file_path = os.path.join(source_dir, filename)
-                params = WorkspaceParams.load_from_file(full_file_path)
-                np_array = None
-                if create_images:
-                    image_filename = filename.replace('.pkl', '.image_pkl')
-                    full_image_file_path = os.path.join(source_dir, image_filename)
-                    if os.path.isfile(full_image_file_path):
-                        np_array = pickle.load(open(full_image_file_path, 'r'))
-                    else:
-                        np_array = self._get_image_as_numpy(params)
-                        pickle.dump(np_array, open(full_image_file_path, 'w'))
-
-                self.items[filename] = ImageCacheItem(filename, full_file_path, params, np_array)
+        self.params_directory = source_dir
+        filenames = self._get_params_filenames(source_dir)
+        if create_images and len(filenames) > 0:
+            _, index = self.load_image_archive(source_dir)
+            if index != filenames:
+                create_image_archive(source_dir)
+                _, index = self.load_image_archive(source_dir)
+            assert index == filenames
+        archive_rows = {filename: i if create_images else None for i, filename in enumerate(filenames)}
+
+        # in lazy mode only the index is built here, the items are loaded on first access
+        self.items = LazyImageCacheItems(source_dir, filenames, archive_rows, max_loaded_items if lazy else None)
+        if not lazy:
+            self.items.values()
+
+    @staticmethod
+    def _get_params_filenames(source_dir):
+        return sorted([filename for filename in os.listdir(source_dir) if filename.endswith('.pkl')])
+
+    @staticmethod
+    def load_image_archive(source_dir):
+        # returns the memory mapped images (pages are shared by all the processes) and the workspace ids, or None if
+        # the archive was not created yet
+        previous_archive_filename = None
+        while True:
+            archive_filename, index = ImageCache._read_index(source_dir)
+            if archive_filename is None or archive_filename == previous_archive_filename:
+                return None, None
+            try:
+                archive = np.load(os.path.join(source_dir, archive_filename), mmap_mode='r')
+            except IOError:
+                # replaced by a newer archive after the index was read, try the new index
+                previous_archive_filename = archive_filename
+                continue
+            if archive.shape[0] != len(index):
+                return None, None
+            return archive, index
+
+    @staticmethod
+    def _read_index(source_dir):
+        # returns the archive filename and the workspace ids, or None if there is no index (or it is of the old format
+        # that did not name the archive)
+        index_path = os.path.join(source_dir, ImageCache.index_filename)
+        if not os.path.isfile(index_path):
+            return None, None
+        with open(index_path, 'r') as index_file:
+            lines = [line.strip() for line in index_file if len(line.strip()) > 0]
+        if len(lines) == 0 or not lines[0].startswith(ImageCache.archive_prefix) or not lines[0].endswith('.npy'):
+            return None, None
+        return lines[0], lines[1:]
 
     def get_image(self, workspace_id):
         assert self._create_images
@@ -54,12 +164,14 @@ class ImageCache:
 
     @staticmethod
     def _figure_to_image(fig):
+        from PIL import Image
         buf = ImageCache._figure_to_nparray(fig)
         w, h, d = buf.shape
         return Image.frombytes("RGBA", (w, h), buf.tobytes())
 
     @staticmethod
     def _remove_transparency(im, bg_colour=(255, 255, 255)):
+        from PIL import Image
         if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
 
             # Need to convert to RGBA if LA format due to a bug in PIL
@@ -77,6 +189,13 @@ class ImageCache:
 
     @staticmethod
     def _get_image_as_numpy(params):
+        return rasterize_workspace(params)
+
+    @staticmethod
+    def _get_image_as_numpy_with_matplotlib(params):
+        # the original rendering, kept as a reference for the rasterizer (slow, requires matplotlib and PIL)
+        from PIL import Image
+        import matplotlib.pyplot as plt
         f = params.print_image()
         im = ImageCache._figure_to_image(f)
         im = ImageCache._remove_transparency(im).convert('L')
@@ -88,7 +207,71 @@ class ImageCache:
         plt.clf()
         return res
 
+    @staticmethod
+    def get_rasterization_error(params):
+        # the mean and max absolute difference between the rasterized and the matplotlib images. the difference is
+        # expected to be small on average (less than a gray level), and limited to the obstacle edges where the
+        # matplotlib downsampling filter rings.
+        difference = np.abs(ImageCache._get_image_as_numpy(params).astype(np.int32) -
+                            ImageCache._get_image_as_numpy_with_matplotlib(params).astype(np.int32))
+        return np.mean(difference), np.max(difference)
+
+
+def _create_image(full_file_path):
+    # an image pickled by a previous version of the cache is used as is
+    full_image_file_path = full_file_path.replace('.pkl', '.image_pkl')
+    if os.path.isfile(full_image_file_path):
+        return np.asarray(pickle.load(open(full_image_file_path, 'r')), dtype=np.uint8)
+    params = WorkspaceParams.load_from_file(full_file_path)
+    return np.asarray(ImageCache._get_image_as_numpy(params), dtype=np.uint8)
+
+
+def create_image_archive(params_directory, processes=None):
+    source_dir = os.path.expanduser(params_directory)
+    filenames = ImageCache._get_params_filenames(source_dir)
+    # images already in an existing archive are not rendered again
+    existing_archive, existing_index = ImageCache.load_image_archive(source_dir)
+    existing_rows = {} if existing_index is None else {
+        workspace_id: row for row, workspace_id in enumerate(existing_index)
+    }
+    missing = [filename for filename in filenames if filename not in existing_rows]
+    print 'creating image archive in {}: {} images to render, {} reused'.format(
+        source_dir, len(missing), len(filenames) - len(missing))
+    rendered = {}
+    if len(missing) > 0:
+        pool = multiprocessing.Pool(processes)
+        try:
+            images = pool.map(_create_image, [os.path.join(source_dir, filename) for filename in missing])
+        finally:
+            pool.close()
+            pool.join()
+        rendered = dict(zip(missing, images))
+
+    image_shape = rendered.values()[0].shape if len(rendered) > 0 else existing_archive.shape[1:]
+    archive = np.zeros((len(filenames), ) + tuple(image_shape), dtype=np.uint8)
+    for i, filename in enumerate(filenames):
+        archive[i] = rendered[filename] if filename in rendered else existing_archive[existing_rows[filename]]
+
+    # the archive is written under a new name and the index that names it is renamed last, so a reader sees either the
+    # old archive and index or the new ones, never a mix
+    replaced_archive_filename, _ = ImageCache._read_index(source_dir)
+    archive_filename = '{}{}.npy'.format(ImageCache.archive_prefix, uuid.uuid4().hex)
+    archive_path = os.path.join(source_dir, archive_filename)
+    index_path = os.path.join(source_dir, ImageCache.index_filename)
+    with open(archive_path + '.tmp', 'wb') as archive_file:
+        np.save(archive_file, archive)
+    os.rename(archive_path + '.tmp', archive_path)
+    with open(index_path + '.tmp', 'w') as index_file:
+        index_file.write('\n'.join([archive_filename] + filenames) + '\n')
+    os.rename(index_path + '.tmp', index_path)
+    # processes that already mapped the replaced archive keep their pages after it is removed
+    if replaced_archive_filename is not None and replaced_archive_filename != archive_filename:
+        try:
+            os.remove(os.path.join(source_dir, replaced_archive_filename))
+        except OSError:
+            pass
+
 
 if __name__ == '__main__':
     path = '~/ModelBasedDDPG/scenario_params/vision'
-    ImageCache(path, True)
+    create_image_archive(path)
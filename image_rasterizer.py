@@ -0,0 +1,52 @@
+import numpy as np
+
+# the images were originally rendered by matplotlib (see ImageCache._get_image_as_numpy): a 576x432 figure (dpi 90),
+# with the workspace x range [-0.5, 0.5] and z range [0, 0.5] drawn at 446.4 pixels per unit, cropped to the box
+# (73, 108, 517, 330) and downsampled to 111x55. the rasterizer below reproduces this geometry directly.
+_PIXELS_PER_UNIT = 446.4
+_CROP_LEFT = -0.5 + (73 - 72.0) / _PIXELS_PER_UNIT
+_CROP_TOP = 0.5 - (108 - 106.56) / _PIXELS_PER_UNIT
+_CROP_WIDTH = 517 - 73
+_CROP_HEIGHT = 330 - 108
+# the obstacle color (#6699cc) in grayscale, over a white background
+OBSTACLE_VALUE = 144
+BACKGROUND_VALUE = 255
+# matplotlib also strokes the obstacle edge (1 point wide at dpi 90), which grows the boxes by half a line width
+_EDGE_DILATION = 0.5 * 90 / 72.0 / _PIXELS_PER_UNIT
+
+
+def rasterize_workspace(params, image_shape=(55, 111), supersampling=4):
+    # returns the workspace occupancy image as uint8, every pixel is shaded by the fraction of its area covered by the
+    # obstacles (estimated with supersampling x supersampling samples per pixel)
+    height, width = image_shape
+    # the centers of the samples, in workspace coordinates
+    sample_offsets = (np.arange(supersampling) + 0.5) / supersampling
+    xs = _CROP_LEFT + (np.arange(width)[:, None] + sample_offsets[None, :]).ravel() * (
+        float(_CROP_WIDTH) / width / _PIXELS_PER_UNIT)
+    zs = _CROP_TOP - (np.arange(height)[:, None] + sample_offsets[None, :]).ravel() * (
+        float(_CROP_HEIGHT) / height / _PIXELS_PER_UNIT)
+    xs, zs = np.meshgrid(xs, zs)
+
+    covered = np.zeros(xs.shape, dtype=bool)
+    for i in range(params.number_of_obstacles):
+        covered |= _is_in_box(
+            xs, zs, params.centers_position_x[i], params.centers_position_z[i], params.sides_x[i], params.sides_z[i],
+            params.y_axis_rotation[i]
+        )
+
+    coverage = covered.reshape(height, supersampling, width, supersampling).mean(axis=(1, 3))
+    image = BACKGROUND_VALUE - coverage * (BACKGROUND_VALUE - OBSTACLE_VALUE)
+    return np.round(image).astype(np.uint8)
+
+
+def _is_in_box(xs, zs, center_x, center_z, side_x, side_z, y_rotation):
+    # the box is rotated by -y_rotation around its center (see WorkspaceParams._get_box_polygon), so the points are
+    # rotated by y_rotation into the box frame
+    cos, sin = np.cos(y_rotation), np.sin(y_rotation)
+    dx = xs - center_x
+    dz = zs - center_z
+    local_x = cos * dx - sin * dz
+    local_z = sin * dx + cos * dz
+    return np.logical_and(
+        np.abs(local_x) <= side_x / 2.0 + _EDGE_DILATION, np.abs(local_z) <= side_z / 2.0 + _EDGE_DILATION
+    )
@@ -43,14 +43,10 @@ class Network(object):
         online_actor_tanh = actor_results[1]
         self.online_actor_params = tf.trainable_variables()[variable_count:]
 
-        # create placeholders and assign ops to set these weights manually (used by rollout agents)
-        self.online_actor_parameter_weights_placeholders = {
-            var.name: tf.placeholder(tf.float32, var.get_shape()) for var in self.online_actor_params
-        }
-        self.online_actor_parameters_assign_ops = [
-            tf.assign(var, self.online_actor_parameter_weights_placeholders[var.name])
-            for var in self.online_actor_params
-        ]
+        # create a flat weights vector, and a placeholder and assign op to set these weights manually (used to sync the
+        # rollout agents)
+        self.online_actor_flat_weights, self.online_actor_flat_weights_placeholder, \
+        self.online_actor_flat_weights_assign_op = self._create_flat_weights_ops(self.online_actor_params)
 
         # target actor network
         variable_count = len(tf.trainable_variables())
@@ -58,14 +54,10 @@ class Network(object):
         self.target_action = actor_results[0]
         self.target_actor_params = tf.trainable_variables()[variable_count:]
 
-        # create placeholders and assign ops to set these weights manually (used by rollout agents)
-        self.target_actor_parameter_weights_placeholders = {
-            var.name: tf.placeholder(tf.float32, var.get_shape()) for var in self.target_actor_params
-        }
-        self.target_actor_parameters_assign_ops = [
-            tf.assign(var, self.target_actor_parameter_weights_placeholders[var.name])
-            for var in self.target_actor_params
-        ]
+        # create a flat weights vector, and a placeholder and assign op to set these weights manually (used to sync the
+        # rollout agents)
+        self.target_actor_flat_weights, self.target_actor_flat_weights_placeholder, \
+        self.target_actor_flat_weights_assign_op = self._create_flat_weights_ops(self.target_actor_params)
 
         # this is as much as a rollout agent needs
         if is_rollout_agent:
@@ -225,6 +217,19 @@ class Network(object):
         termination_probability = tf.split(softmax_output, 2, axis=1)[1]
         return termination_probability
 
+    @staticmethod
+    def _create_flat_weights_ops(params):
+        # a single float32 vector holding all the parameters (in creation order), and one op that splits such a vector
+        # and assigns all the parameters
+        flat_weights = tf.concat([tf.reshape(var, [-1]) for var in params], axis=0)
+        sizes = [int(np.prod(var.get_shape().as_list())) for var in params]
+        flat_weights_placeholder = tf.placeholder(tf.float32, (sum(sizes), ))
+        parts = tf.split(flat_weights_placeholder, sizes)
+        assign_op = tf.group(*[
+            tf.assign(var, tf.reshape(part, var.get_shape())) for var, part in zip(params, parts)
+        ])
+        return flat_weights, flat_weights_placeholder, assign_op
+
     @staticmethod
     def _optimize_by_loss(loss, parameters_to_optimize, learning_rate, gradient_limit):
         optimizer = tf.train.AdamOptimizer(learning_rate)
@@ -381,15 +386,17 @@ class Network(object):
         return sess.run(weights)
 
     def set_actor_weights(self, sess, weights, is_online):
-        params = self.online_actor_params if is_online else self.target_actor_params
-        placeholders = self.online_actor_parameter_weights_placeholders if is_online else \
-            self.target_actor_parameter_weights_placeholders
-        feed = {
-            placeholders[var.name]: weights[i]
-            for i, var in enumerate(params)
-        }
-        ops = self.online_actor_parameters_assign_ops if is_online else self.target_actor_parameters_assign_ops
-        sess.run(ops, feed)
+        flat_weights = np.concatenate([np.ravel(w) for w in weights]).astype(np.float32)
+        self.set_actor_flat_weights(sess, flat_weights, is_online)
+
+    def get_actor_flat_weights(self, sess, is_online):
+        return sess.run(self.online_actor_flat_weights if is_online else self.target_actor_flat_weights)
+
+    def set_actor_flat_weights(self, sess, flat_weights, is_online):
+        placeholder = self.online_actor_flat_weights_placeholder if is_online else \
+            self.target_actor_flat_weights_placeholder
+        assign_op = self.online_actor_flat_weights_assign_op if is_online else self.target_actor_flat_weights_assign_op
+        sess.run(assign_op, {placeholder: flat_weights})
 
     def update_target_networks(self, sess):
         sess.run([self.update_critic_target_params, self.update_actor_target_params])
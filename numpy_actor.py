@@ -0,0 +1,83 @@
+import numpy as np
+
+from numpy_modeling_utils import NumpyDqnModel, dense, get_activation, l2_normalize
+
+
+class NumpyActor:
+    # evaluates the actor of network.Network without tensorflow. the weights are the output of
+    # Network.get_actor_weights, i.e. the actor variables in creation order: the perception variables (if the image is
+    # considered), the hidden layers kernels and biases, and finally the tanh layer kernel and bias.
+    def __init__(self, config, image_shape=(55, 111), number_of_joints=4, pose_dimensions=2):
+        self.config = config
+        self.image_shape = image_shape
+        self.number_of_joints = number_of_joints
+        self.pose_dimensions = pose_dimensions
+        self.consider_image = config['model']['consider_image']
+        self.activation = get_activation(config['action_predictor']['activation'])
+        self.hidden_layers_count = len(config['action_predictor']['layers'])
+        self.weights_shapes = self._get_weights_shapes()
+        self.weights_count = sum([int(np.prod(shape)) for shape in self.weights_shapes])
+
+        self.online_weights = None
+        self.target_weights = None
+
+    def _get_weights_shapes(self):
+        shapes = []
+        features_size = 2 * self.number_of_joints + self.pose_dimensions
+        if self.consider_image:
+            # two strided convolutions with padding='same' (see DqnModel)
+            conv1_shape = [-(-d // 4) for d in self.image_shape]
+            conv2_shape = [-(-d // 2) for d in conv1_shape]
+            shapes += [
+                (8, 8, 1, 32), (32, ), (4, 4, 32, 64), (64, ), (conv2_shape[0] * conv2_shape[1] * 64, 512), (512, ),
+                (512, 512), (512, )
+            ]
+            features_size += 512
+        layers = self.config['action_predictor']['layers'] + [self.number_of_joints]
+        for layer_size in layers:
+            shapes += [(features_size, layer_size), (layer_size, )]
+            features_size = layer_size
+        return shapes
+
+    def set_actor_flat_weights(self, flat_weights, is_online):
+        # splits the output of Network.get_actor_flat_weights, the resulting weights are views (no copy is made)
+        flat_weights = np.asarray(flat_weights, dtype=np.float32)
+        assert flat_weights.shape == (self.weights_count, )
+        weights = []
+        offset = 0
+        for shape in self.weights_shapes:
+            size = int(np.prod(shape))
+            weights.append(flat_weights[offset: offset + size].reshape(shape))
+            offset += size
+        self.set_actor_weights(weights, is_online)
+
+    def set_actor_weights(self, weights, is_online):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        expected_count = 2 * (self.hidden_layers_count + 1)
+        if self.consider_image:
+            expected_count += NumpyDqnModel.variables_count
+        assert len(weights) == expected_count
+        if is_online:
+            self.online_weights = weights
+        else:
+            self.target_weights = weights
+
+    def predict_action(self, joint_inputs, workspace_image_inputs, goal_pose_inputs, goal_joints_inputs,
+                       use_online_network):
+        weights = self.online_weights if use_online_network else self.target_weights
+        assert weights is not None
+        # generate the policy features: [joints, goal joints, perception, goal pose]
+        features = [np.asarray(joint_inputs, dtype=np.float32), np.asarray(goal_joints_inputs, dtype=np.float32)]
+        if self.consider_image:
+            images_3d = np.expand_dims(np.asarray(workspace_image_inputs, dtype=np.float32), axis=-1)
+            perception = NumpyDqnModel(weights[:NumpyDqnModel.variables_count])
+            features.append(perception.predict(images_3d))
+            weights = weights[NumpyDqnModel.variables_count:]
+        features.append(np.asarray(goal_pose_inputs, dtype=np.float32))
+        current = np.concatenate(features, axis=1)
+        # hidden layers
+        for i in range(self.hidden_layers_count):
+            current = dense(current, weights[2 * i], weights[2 * i + 1], self.activation)
+        # tanh layer, followed by normalization
+        tanh_preactivation = dense(current, weights[-2], weights[-1])
+        return l2_normalize(np.tanh(tanh_preactivation))
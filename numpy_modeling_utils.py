@@ -0,0 +1,81 @@
+import numpy as np
+
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+
+def _elu(x):
+    return np.where(x > 0.0, x, np.expm1(np.minimum(x, 0.0)))
+
+
+def get_activation(activation):
+    # numpy counterpart of modeling_utils.get_activation
+    if activation == 'relu':
+        return _relu
+    if activation == 'tanh':
+        return np.tanh
+    if activation == 'elu':
+        return _elu
+    return None
+
+
+def dense(inputs, kernel, bias=None, activation=None):
+    result = np.dot(inputs, kernel)
+    if bias is not None:
+        result += bias
+    if activation is not None:
+        result = activation(result)
+    return result
+
+
+def conv2d_same(inputs, kernel, bias, stride):
+    # inputs are NHWC and the kernel is (height, width, in channels, out channels) as in tf.layers.conv2d
+    batch, height, width, channels = inputs.shape
+    kernel_height, kernel_width = kernel.shape[0], kernel.shape[1]
+    # padding='same' in tensorflow pads so that output = ceil(input / stride), extra padding goes to the end
+    output_height = -(-height // stride)
+    output_width = -(-width // stride)
+    pad_height = max((output_height - 1) * stride + kernel_height - height, 0)
+    pad_width = max((output_width - 1) * stride + kernel_width - width, 0)
+    padded = np.pad(inputs, (
+        (0, 0), (pad_height // 2, pad_height - pad_height // 2), (pad_width // 2, pad_width - pad_width // 2), (0, 0)
+    ), mode='constant')
+    padded = np.ascontiguousarray(padded)
+    # view every receptive field as a separate patch (no copy) and contract it with the kernel
+    s0, s1, s2, s3 = padded.strides
+    patches = np.lib.stride_tricks.as_strided(
+        padded, shape=(batch, output_height, output_width, kernel_height, kernel_width, channels),
+        strides=(s0, s1 * stride, s2 * stride, s1, s2, s3), writeable=False
+    )
+    return np.tensordot(patches, kernel, axes=([3, 4, 5], [0, 1, 2])) + bias
+
+
+def l2_normalize(x, epsilon=1e-12):
+    # same as tf.nn.l2_normalize on axis 1
+    square_sum = np.sum(np.square(x), axis=1, keepdims=True)
+    return x / np.sqrt(np.maximum(square_sum, epsilon))
+
+
+def softmax(logits):
+    shifted = logits - np.max(logits, axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / np.sum(exp, axis=1, keepdims=True)
+
+
+class NumpyDqnModel:
+    # numpy counterpart of dqn_model.DqnModel, consumes the 8 variables the tf model creates (in creation order)
+    variables_count = 8
+
+    def __init__(self, weights):
+        assert len(weights) == NumpyDqnModel.variables_count
+        self.weights = weights
+
+    def predict(self, workspace_image):
+        conv1_kernel, conv1_bias, conv2_kernel, conv2_bias, dense1_kernel, dense1_bias, dense2_kernel, dense2_bias = \
+            self.weights
+        conv1 = _relu(conv2d_same(workspace_image, conv1_kernel, conv1_bias, 4))
+        conv2 = _relu(conv2d_same(conv1, conv2_kernel, conv2_bias, 2))
+        flat = np.reshape(conv2, (conv2.shape[0], -1))
+        dense1 = dense(flat, dense1_kernel, dense1_bias, _relu)
+        return dense(dense1, dense2_kernel, dense2_bias)
@@ -0,0 +1,72 @@
+import numpy as np
+
+from numpy_modeling_utils import NumpyDqnModel, dense, get_activation, softmax
+
+
+class NumpyReward:
+    # evaluates the reward network of pre_trained_reward.PreTrainedReward without tensorflow. the weights are the output
+    # of PreTrainedReward.get_weights, i.e. the reward variables in creation order: the perception variables (if vision
+    # is enabled), the classification layers kernels and biases, the classification reward kernel and the clipping
+    # weight kernel.
+    def __init__(self, config):
+        self.config = config
+        self.is_vision_enabled = 'vision' in config['general']['scenario']
+        self.activation = get_activation(config['reward']['activation'])
+        self.layers_count = len(config['reward']['layers']) + 1
+        self.action_step_size = config['openrave_rl']['action_step_size']
+        # the same bounds as in PreTrainedReward._next_state_model
+        joint_safety = 0.0001
+        lower_bounds = [-2.617, -1.571, -1.571, -1.745, -2.617]
+        self.lower_bounds = np.array([b + joint_safety for b in lower_bounds[1:]], dtype=np.float32)
+        self.upper_bounds = -self.lower_bounds
+
+        self.weights = None
+
+    def set_weights(self, weights):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        expected_count = 2 * self.layers_count + 2
+        if self.is_vision_enabled:
+            expected_count += NumpyDqnModel.variables_count
+        assert len(weights) == expected_count
+        self.weights = weights
+
+    def make_prediction(self, all_start_joints, all_goal_joints, all_actions, all_goal_poses,
+                        all_transition_labels=None, images=None):
+        # same outputs as PreTrainedReward.make_prediction: the rewards and the status logits
+        assert self.weights is not None
+        weights = self.weights
+        start_joints = np.asarray(all_start_joints, dtype=np.float32)
+        # next step is a deterministic computation
+        unclipped_next_joints = start_joints + np.asarray(all_actions, dtype=np.float32) * self.action_step_size
+        clipped_next_joints = np.minimum(np.maximum(unclipped_next_joints, self.lower_bounds), self.upper_bounds)
+
+        # predict the transition classification
+        features = [
+            clipped_next_joints, np.asarray(all_goal_joints, dtype=np.float32),
+            np.asarray(all_goal_poses, dtype=np.float32)
+        ]
+        if self.is_vision_enabled:
+            assert images is not None
+            images_3d = np.expand_dims(np.asarray(images, dtype=np.float32), axis=-1)
+            features.append(NumpyDqnModel(weights[:NumpyDqnModel.variables_count]).predict(images_3d))
+            weights = weights[NumpyDqnModel.variables_count:]
+        current = np.concatenate(features, axis=1)
+        for i in range(self.layers_count):
+            _activation = None if i == self.layers_count - 1 else self.activation
+            current = dense(current, weights[2 * i], weights[2 * i + 1], _activation)
+        softmax_logits = current
+
+        # if the one-hot label is given, it replaces the predicted status distribution
+        reward_calculation_input = softmax(softmax_logits)
+        if all_transition_labels is not None:
+            transition_labels = np.asarray(all_transition_labels, dtype=np.float32)
+            is_labeled = np.max(transition_labels, axis=1, keepdims=True)
+            reward_calculation_input = transition_labels + (1.0 - is_labeled) * reward_calculation_input
+        classification_reward = dense(reward_calculation_input, weights[-2])
+
+        # the clipping-related reward
+        clipped_difference = np.sum(np.abs(unclipped_next_joints - clipped_next_joints), axis=1, keepdims=True)
+        clipping_reward = dense(clipped_difference, weights[-1])
+
+        total_reward = classification_reward + clipping_reward
+        return total_reward, softmax_logits
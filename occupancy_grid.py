@@ -0,0 +1,219 @@
+import os
+import sys
+import copy
+import itertools
+import multiprocessing
+import numpy as np
+
+# a grid over the joint space of the four active joints (the first joint is fixed at 0.0) of a single workspace. the
+# active joints rotate about parallel axes (normal to the x-z plane), so when they change by delta every point of the
+# robot moves in the x-z plane by at most sum_i(reach_i * |delta_i|), where reach_i bounds the distance of the points
+# moved by joint i from its anchor. every configuration in a cell is within half a cell (in every joint) of one of the
+# cell corners, so with margin = sum_i(reach_i * cell_size_i / 2):
+# - if the robot at every corner is clear of the obstacles grown by margin, no configuration in the cell collides with
+#   an obstacle (CERTAIN_FREE, the self collision is not covered and is still checked exactly)
+# - if the robot at every corner collides with the obstacles shrunk by margin, every configuration in the cell collides
+#   with an obstacle (CERTAIN_OCCUPIED)
+# every other query is UNKNOWN and is left to the exact check. the trusted cells are saved bit-packed in an .npz next to
+# the workspace params file.
+UNKNOWN = 0
+CERTAIN_FREE = 1
+CERTAIN_OCCUPIED = 2
+# grids of older versions (without the margin) are not trusted
+GRID_VERSION = 2
+
+
+def get_grid_path(params_path):
+    return os.path.splitext(params_path)[0] + '_grid.npz'
+
+
+class OccupancyGrid:
+    def __init__(self, lower, upper, certain_free, certain_occupied):
+        # lower and upper are the bounds of the active joints, the cells arrays are of shape (cells_per_joint, ) * 4
+        self.lower = np.array(lower, dtype=np.float64)
+        self.upper = np.array(upper, dtype=np.float64)
+        self.cells_per_joint = np.array(certain_free.shape)
+        self.cell_size = (self.upper - self.lower) / self.cells_per_joint
+        self.status = np.full(certain_free.shape, UNKNOWN, dtype=np.int8)
+        self.status[certain_free] = CERTAIN_FREE
+        self.status[certain_occupied] = CERTAIN_OCCUPIED
+
+    @staticmethod
+    def load(grid_path):
+        # returns None if the grid was built by an older version
+        data = np.load(grid_path)
+        if 'version' not in data.files or data['version'] < GRID_VERSION:
+            return None
+        shape = tuple(data['shape'])
+        cells = np.prod(shape)
+        return OccupancyGrid(
+            data['lower'], data['upper'], np.unpackbits(data['certain_free'])[:cells].reshape(shape).astype(bool),
+            np.unpackbits(data['certain_occupied'])[:cells].reshape(shape).astype(bool)
+        )
+
+    def get_status(self, joints):
+        # joints is an array of (rows, 5) (all the joints), returns the status of every row
+        joints = np.atleast_2d(joints)
+        active_joints = joints[:, 1:]
+        cells = np.floor((active_joints - self.lower) / self.cell_size).astype(np.int64)
+        is_inside = np.all(np.logical_and(cells >= 0, cells < self.cells_per_joint), axis=1)
+        # the grid was built with the first joint at 0.0
+        is_inside &= joints[:, 0] == 0.0
+        result = np.full(len(active_joints), UNKNOWN, dtype=np.int8)
+        inside_cells = cells[is_inside]
+        result[is_inside] = self.status[
+            inside_cells[:, 0], inside_cells[:, 1], inside_cells[:, 2], inside_cells[:, 3]]
+        return result
+
+
+def _get_vertices(lower, upper, vertices_per_joint):
+    return [np.linspace(lower[i], upper[i], vertices_per_joint) for i in range(len(lower))]
+
+
+_worker_manager = None
+_worker_grown_params = None
+_worker_shrunk_params = None
+
+
+def _get_joint_reaches(openrave_manager):
+    # for every active joint, an upper bound of the distance of the points of the robot it moves from its anchor (for
+    # any configuration): the links that are rigid in the frame of the joint are bounded by their bounding boxes, and
+    # the links moved by the next joint by the distance to the next anchor plus the reach of the next joint
+    robot = openrave_manager.robot
+    joints = [robot.GetJointFromDOFIndex(i) for i in range(1, 5)]
+    axes = np.array([joint.GetAxis() for joint in joints])
+    # the bound assumes planar motion in the x-z plane, which the obstacles are extruded from
+    assert np.allclose(np.abs(axes[:, 1]), 1.0)
+    reaches = [0.0] * len(joints)
+    for i in reversed(range(len(joints))):
+        anchor = np.array(joints[i].GetAnchor())
+        reach = 0.0
+        for link in robot.GetLinks():
+            is_moved = robot.DoesAffect(joints[i].GetJointIndex(), link.GetIndex())
+            is_moved_by_next = i + 1 < len(joints) and robot.DoesAffect(joints[i + 1].GetJointIndex(), link.GetIndex())
+            if is_moved and not is_moved_by_next:
+                aabb = link.ComputeAABB()
+                reach = max(reach, np.linalg.norm(np.abs(aabb.pos() - anchor) + aabb.extents()))
+        if i + 1 < len(joints):
+            reach = max(reach, np.linalg.norm(np.array(joints[i + 1].GetAnchor()) - anchor) + reaches[i + 1])
+        reaches[i] = reach
+    return np.array(reaches)
+
+
+def _get_margin(lower, upper, vertices_per_joint):
+    half_cell_size = (upper - lower) / (vertices_per_joint - 1) / 2.0
+    return np.sum(_get_joint_reaches(_worker_manager) * half_cell_size)
+
+
+def _resize_obstacles(workspace_params, margin):
+    # grows (or shrinks, if the margin is negative) the sides of the boxes by margin in the x-z plane, boxes that
+    # shrink to nothing are removed
+    result = copy.deepcopy(workspace_params)
+    keep = [
+        i for i in range(workspace_params.number_of_obstacles)
+        if workspace_params.sides_x[i] + 2.0 * margin > 0.0 and workspace_params.sides_z[i] + 2.0 * margin > 0.0
+    ]
+    result.number_of_obstacles = len(keep)
+    result.centers_position_x = [workspace_params.centers_position_x[i] for i in keep]
+    result.centers_position_z = [workspace_params.centers_position_z[i] for i in keep]
+    result.sides_x = [workspace_params.sides_x[i] + 2.0 * margin for i in keep]
+    result.sides_z = [workspace_params.sides_z[i] + 2.0 * margin for i in keep]
+    result.y_axis_rotation = [workspace_params.y_axis_rotation[i] for i in keep]
+    result.rays = [workspace_params.rays[i] for i in keep] if len(workspace_params.rays) > 0 else []
+    return result
+
+
+def _init_worker(params_path, vertices_per_joint):
+    global _worker_manager, _worker_grown_params, _worker_shrunk_params
+    from openrave_manager import OpenraveManager
+    from workspace_generation_utils import WorkspaceParams
+    # only the validity is needed (no segments or potential points)
+    _worker_manager = OpenraveManager(0.001, [])
+    lower, upper = _get_bounds()
+    margin = _get_margin(lower, upper, vertices_per_joint)
+    # the obstacles as loaded by the other modules (see OpenraveManager.set_params)
+    workspace_params = WorkspaceParams.load_from_file(params_path)
+    _worker_grown_params = _resize_obstacles(workspace_params, margin)
+    _worker_shrunk_params = _resize_obstacles(workspace_params, -margin)
+
+
+def _get_bounds():
+    bounds = _worker_manager.get_joint_bounds()
+    safety = _worker_manager.joint_safety
+    return np.array(bounds[0][1:]) + safety, np.array(bounds[1][1:]) - safety
+
+
+def _get_collisions(workspace_params, first_joint_index, vertices):
+    # whether the robot collides with the obstacles (not itself) at the vertices with the first active joint at the
+    # given index
+    vertices_per_joint = len(vertices[0])
+    _worker_manager.remove_objects()
+    _worker_manager.load_params(workspace_params, None)
+    result = np.zeros((vertices_per_joint, ) * 3, dtype=bool)
+    if workspace_params.number_of_obstacles == 0:
+        return result
+    with _worker_manager.env:
+        for i, j, k in itertools.product(range(vertices_per_joint), repeat=3):
+            _worker_manager.robot.SetDOFValues(
+                (0.0, vertices[0][first_joint_index], vertices[1][i], vertices[2][j], vertices[3][k]), [0, 1, 2, 3, 4])
+            result[i, j, k] = _worker_manager.is_colliding_with_objects()
+    return result
+
+
+def _validate_slice(args):
+    # the clear and the colliding vertices with the first active joint at the given index
+    first_joint_index, vertices_per_joint = args
+    lower, upper = _get_bounds()
+    vertices = _get_vertices(lower, upper, vertices_per_joint)
+    is_clear = np.logical_not(_get_collisions(_worker_grown_params, first_joint_index, vertices))
+    is_colliding = _get_collisions(_worker_shrunk_params, first_joint_index, vertices)
+    return first_joint_index, is_clear, is_colliding
+
+
+def _all_corners(valid_vertices):
+    # for every cell, whether all its 16 corners are set
+    cells_shape = tuple(np.array(valid_vertices.shape) - 1)
+    result = np.ones(cells_shape, dtype=bool)
+    for corner in itertools.product([0, 1], repeat=4):
+        result &= valid_vertices[tuple(slice(c, c + s) for c, s in zip(corner, cells_shape))]
+    return result
+
+
+def build_occupancy_grid(params_path, vertices_per_joint=24, processes=None):
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(params_path, vertices_per_joint))
+    try:
+        lower, upper = pool.apply(_get_bounds)
+        clear_vertices = np.zeros((vertices_per_joint, ) * 4, dtype=bool)
+        colliding_vertices = np.zeros((vertices_per_joint, ) * 4, dtype=bool)
+        tasks = [(i, vertices_per_joint) for i in range(vertices_per_joint)]
+        for first_joint_index, is_clear, is_colliding in pool.imap_unordered(_validate_slice, tasks):
+            clear_vertices[first_joint_index] = is_clear
+            colliding_vertices[first_joint_index] = is_colliding
+    finally:
+        pool.close()
+        pool.join()
+    certain_free = _all_corners(clear_vertices)
+    certain_occupied = _all_corners(colliding_vertices)
+    grid_path = get_grid_path(params_path)
+    with open(grid_path + '.tmp', 'wb') as grid_file:
+        np.savez(
+            grid_file, version=GRID_VERSION, lower=lower, upper=upper, shape=np.array(certain_free.shape),
+            certain_free=np.packbits(certain_free), certain_occupied=np.packbits(certain_occupied)
+        )
+    os.rename(grid_path + '.tmp', grid_path)
+    print 'occupancy grid for {}: {} free and {} occupied of {} cells'.format(
+        params_path, np.count_nonzero(certain_free), np.count_nonzero(certain_occupied), certain_free.size)
+    return grid_path
+
+
+if __name__ == '__main__':
+    # usage: python occupancy_grid.py params_directory, builds the missing (or outdated) grids of all the workspaces in
+    # the directory
+    params_dir = os.path.abspath(os.path.expanduser(sys.argv[1]))
+    for filename in sorted(os.listdir(params_dir)):
+        params_path = os.path.join(params_dir, filename)
+        if not filename.endswith('.pkl'):
+            continue
+        grid_path = get_grid_path(params_path)
+        if not os.path.isfile(grid_path) or OccupancyGrid.load(grid_path) is None:
+            build_occupancy_grid(params_path)
@@ -4,12 +4,13 @@ import numpy as np
 import time
 from openravepy import *
 import data_filepaths
+import occupancy_grid
 from potential_point import PotentialPoint
 from workspace_generation_utils import WorkspaceParams
 
 
 class OpenraveManager(object):
-    def __init__(self, segment_validity_step, potential_points):
+    def __init__(self, segment_validity_step, potential_points, use_occupancy_grid=False):
         # env_path = os.path.abspath(
         #     os.path.expanduser('~/ModelBasedDDPG/config/widowx_env.xml'))
         env_path = os.path.join(os.getcwd(), 'data', 'config', 'widowx_env.xml')
@@ -31,6 +32,11 @@ class OpenraveManager(object):
         self.joint_safety = 0.0001
         self.loaded_params_path = None
         self.loaded_params = None
+        self.plan_cache = None
+        # if the workspace has an occupancy grid (see occupancy_grid.py), it answers the obstacle collision queries it
+        # is sure of (the self collision is always checked)
+        self.use_occupancy_grid = use_occupancy_grid
+        self.occupancy_grid = None
 
     def load_params(self, workspace_params, params_path):
         if self.loaded_params_path is not None and self.loaded_params_path == params_path:
@@ -58,6 +64,10 @@ class OpenraveManager(object):
                 self.objects.append(body)
         self.loaded_params_path = params_path
         self.loaded_params = workspace_params
+        if self.use_occupancy_grid and params_path is not None:
+            grid_path = occupancy_grid.get_grid_path(params_path)
+            if os.path.isfile(grid_path):
+                self.occupancy_grid = occupancy_grid.OccupancyGrid.load(grid_path)
 
     def remove_objects(self):
         with self.env:
@@ -66,6 +76,7 @@ class OpenraveManager(object):
                 self.env.Remove(body)
         self.loaded_params_path = None
         self.loaded_params = None
+        self.occupancy_grid = None
 
     def set_params(self, params_path):
         loaded = self.loaded_params_path
@@ -96,6 +107,21 @@ class OpenraveManager(object):
         result = self.truncate_joints(result)
         return tuple(result)
 
+    def get_random_joints_batch(self, number_of_joints, fixed_positions_dictionary=None, random_state=None):
+        # same as get_random_joints, returns an array of (number_of_joints, joints), sampled from random_state if given
+        if random_state is None:
+            random_state = np.random
+        lower, upper = [np.array(b) for b in self.get_joint_bounds()]
+        result = random_state.uniform(lower, upper, (number_of_joints, self.get_number_of_joints()))
+        if fixed_positions_dictionary is not None:
+            for i in fixed_positions_dictionary:
+                result[:, i] = fixed_positions_dictionary[i]
+        return self.truncate_joints_batch(result)
+
+    def truncate_joints_batch(self, joints):
+        lower, upper = [np.array(b) for b in self.get_joint_bounds()]
+        return np.clip(joints, lower + self.joint_safety, upper - self.joint_safety)
+
     def truncate_joints(self, joints):
 
         bounds = self.get_joint_bounds()
@@ -108,17 +134,71 @@ class OpenraveManager(object):
         return tuple(res)
 
     def is_valid(self, joints):
+        check_objects = True
+        if self.occupancy_grid is not None:
+            status = self.occupancy_grid.get_status(joints)[0]
+            if status == occupancy_grid.CERTAIN_OCCUPIED:
+                return False
+            # the grid does not cover the self collision
+            check_objects = status != occupancy_grid.CERTAIN_FREE
+        return self._is_valid_exact(joints, check_objects)
+
+    def _is_valid_exact(self, joints, check_objects=True):
         self.robot.SetDOFValues(joints, [0, 1, 2, 3, 4])
         res = not self.robot.CheckSelfCollision()
+        if check_objects:
+            res = res and not self.is_colliding_with_objects()
+        return res
+
+    def is_colliding_with_objects(self):
+        # in the current dof values of the robot
         if self.objects is not None:
             for item in self.objects:
-                res = res and not self.env.CheckCollision(self.robot, item)
-        return res
+                if self.env.CheckCollision(self.robot, item):
+                    return True
+        return False
+
+    def are_valid(self, joints):
+        # is_valid of every row, the environment is locked once for the entire batch
+        with self.env:
+            return np.array([self.is_valid(j) for j in joints], dtype=bool)
+
+    def get_random_valid_joints_batch(self, number_of_joints, fixed_positions_dictionary=None):
+        # rejection sampling in batches, every round samples enough candidates for the estimated acceptance rate
+        result = []
+        found = 0
+        acceptance_rate = 1.0
+        while found < number_of_joints:
+            missing = number_of_joints - found
+            candidates = self.get_random_joints_batch(
+                int(np.ceil(missing / acceptance_rate)), fixed_positions_dictionary)
+            valid = candidates[self.are_valid(candidates)]
+            acceptance_rate = max(float(len(valid)) / len(candidates), 0.01)
+            result.append(valid[:missing])
+            found += len(result[-1])
+        return np.concatenate(result, axis=0)
+
+    def set_plan_cache(self, plan_cache):
+        # plans are first looked up in the cache (see plan_cache.PlanCache), new plans are added to it
+        self.plan_cache = plan_cache
 
     def plan(self, start_joints, goal_joints, max_planner_iterations):
         with self.env:
             if not self.is_valid(start_joints) or not self.is_valid(goal_joints):
                 return None
+        if self.plan_cache is None or self.loaded_params is None:
+            return self._plan(start_joints, goal_joints, max_planner_iterations)
+        # the loaded obstacles identify the workspace
+        workspace_key = self.plan_cache.get_workspace_key(self.loaded_params)
+        traj = self.plan_cache.get(workspace_key, start_joints, goal_joints, self)
+        if traj is None:
+            traj = self._plan(start_joints, goal_joints, max_planner_iterations)
+            if traj is not None:
+                self.plan_cache.put(workspace_key, goal_joints, traj)
+        return traj
+
+    def _plan(self, start_joints, goal_joints, max_planner_iterations):
+        with self.env:
             self.robot.SetDOFValues(start_joints, [0, 1, 2, 3, 4])
             manipprob = interfaces.BaseManipulation(self.robot)  # create the interface for basic manipulation programs
             try:
@@ -134,7 +214,7 @@ class OpenraveManager(object):
                 traj = [[0.0] + traj[x:x + items_per_trajectory_step][:active_joints] for x in
                         xrange(0, len(traj), items_per_trajectory_step)]
                 # assert validity
-                if self.get_last_valid_in_trajectory(traj) != traj[-1]:
+                if not self.is_path_valid(traj):
                     return None
                 # plan found and validated!
                 return traj
@@ -142,14 +222,59 @@ class OpenraveManager(object):
                 print str(e)
                 return None
 
+    def _get_objects_to_check(self, states):
+        # for every state, whether the collision with the objects should be checked (the occupancy grid is not certain
+        # the state is clear of the objects), None if any of the states is certainly occupied
+        if self.occupancy_grid is None:
+            return np.ones(len(states), dtype=bool)
+        status = self.occupancy_grid.get_status(states)
+        if np.any(status == occupancy_grid.CERTAIN_OCCUPIED):
+            return None
+        return status == occupancy_grid.UNKNOWN
+
     def check_segment_validity(self, start_joints, end_joints):
-        steps = self.partition_segment(start_joints, end_joints)
-        random.shuffle(steps)
-        for step in steps:
-            if not self.is_valid(step):
+        steps = np.array(self.partition_segment(start_joints, end_joints))
+        check_objects = self._get_objects_to_check(steps)
+        if check_objects is None:
+            return False
+        order = range(len(steps))
+        random.shuffle(order)
+        for i in order:
+            if not self._is_valid_exact(steps[i], check_objects[i]):
                 return False
         return True
 
+    def check_segments_validity(self, start_joints, end_joints):
+        # check_segment_validity of every pair of rows, the environment is locked once for the entire batch
+        start_joints = np.array(start_joints, dtype=np.float64)
+        end_joints = np.array(end_joints, dtype=np.float64)
+        result = np.ones(len(start_joints), dtype=bool)
+        with self.env:
+            for i in range(len(start_joints)):
+                steps = self.partition_segment_array(start_joints[i], end_joints[i])
+                check_objects = self._get_objects_to_check(steps)
+                if check_objects is None:
+                    result[i] = False
+                    continue
+                for j in np.random.permutation(len(steps)):
+                    if not self._is_valid_exact(steps[j], check_objects[j]):
+                        result[i] = False
+                        break
+        return result
+
+    def partition_segment_array(self, start_joints, end_joints):
+        # same steps as partition_segment, as an array of (steps, joints)
+        difference = end_joints - start_joints
+        difference_norm = np.linalg.norm(difference)
+        step_size = self.segment_validity_step
+        if difference_norm < step_size:
+            return end_joints[None, :]
+        alphas = np.arange(1, int(np.floor(difference_norm / step_size)) + 1)
+        steps = start_joints + (alphas * (step_size / difference_norm))[:, None] * difference
+        if np.linalg.norm(steps[-1] - end_joints) > 0.0:
+            steps = np.concatenate((steps, end_joints[None, :]), axis=0)
+        return steps
+
     def partition_segment(self, start_joints, end_joints):
         # partition the segment between start joints to end joints
         current = np.array(start_joints)
@@ -173,6 +298,60 @@ class OpenraveManager(object):
             # append to list of configuration points to test validity
             return [tuple(s) for s in steps]
 
+    @staticmethod
+    def resample_path(path, step_size):
+        # splits every segment of the path to steps of step_size (the last step of a segment may be shorter), the same
+        # steps as partition_segment for all the segments together. returns an array of (states, joints)
+        path = np.array(path, dtype=np.float64)
+        starts = path[:-1]
+        differences = path[1:] - starts
+        norms = np.linalg.norm(differences, axis=1)
+        # the number of full steps in every segment (none if the segment is shorter than a step)
+        steps_count = np.where(norms < step_size, 0, np.floor(norms / step_size)).astype(np.int64)
+        segment_indices = np.repeat(np.arange(len(starts)), steps_count)
+        step_indices = np.arange(len(segment_indices)) - np.repeat(np.cumsum(steps_count) - steps_count, steps_count)
+        scales = (step_indices + 1) * step_size / norms[segment_indices]
+        full_steps = starts[segment_indices] + scales[:, None] * differences[segment_indices]
+        # the end of every segment, unless the last full step reached it exactly
+        has_full_steps = steps_count > 0
+        has_leftover = np.ones(len(starts), dtype=bool)
+        last_full_steps = full_steps[np.cumsum(steps_count)[has_full_steps] - 1]
+        has_leftover[has_full_steps] = np.linalg.norm(last_full_steps - path[1:][has_full_steps], axis=1) > 0.0
+        # place the states of every segment after the states of the previous segments
+        states_count = steps_count + has_leftover
+        offsets = 1 + np.cumsum(states_count) - states_count
+        states = np.zeros((1 + np.sum(states_count), path.shape[1]))
+        states[0] = path[0]
+        states[offsets[segment_indices] + step_indices] = full_steps
+        states[(offsets + steps_count)[has_leftover]] = path[1:][has_leftover]
+        return states
+
+    def is_path_valid(self, path):
+        # the states along the path (every segment_validity_step) are checked in a coarse to fine order: first every
+        # 2^k-th state for the largest k, then the states between them. a collision is usually found after a few checks
+        states = self.resample_path(path, self.segment_validity_step)[1:]
+        positions = np.arange(1, len(states) + 1)
+        order = np.argsort(-(positions & -positions), kind='mergesort')
+        states = states[order]
+        check_objects = self._get_objects_to_check(states)
+        if check_objects is None:
+            return False
+        with self.env:
+            for i in range(len(states)):
+                if not self._is_valid_exact(states[i], check_objects[i]):
+                    return False
+        return True
+
+    def get_potential_points_poses_batch(self, joints):
+        # get_potential_points_poses of every row, the environment is locked once for the entire batch
+        with self.env:
+            return [self.get_potential_points_poses(j) for j in joints]
+
+    def process_path(self, path, action_step_size):
+        # a (valid) plan as the list of action steps and the potential points poses in every step
+        trajectory = [tuple(s) for s in self.resample_path(path, action_step_size)]
+        return trajectory, self.get_potential_points_poses_batch(trajectory)
+
     def get_last_valid_in_trajectory(self, trajectory):
         for i in range(len(trajectory)-1):
             if not self.check_segment_validity(trajectory[i], trajectory[i+1]):
@@ -230,6 +409,11 @@ class OpenraveManager(object):
         # target is the last potential
         return self.get_potential_points_poses(joints)[self.potential_points[-1].tuple]
 
+    def get_target_poses(self, joints):
+        # get_target_pose of every row, as an array of (rows, 2)
+        with self.env:
+            return np.array([self.get_target_pose(j) for j in joints])
+
     @staticmethod
     def _post_process_jacobian(j, is_numeric=False):
         return j[[0, 2], 1 if is_numeric else 0:].transpose()
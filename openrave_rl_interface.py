@@ -15,8 +15,11 @@ class OpenraveRLInterface:
         self.keep_alive_penalty = config['openrave_rl']['keep_alive_penalty']
         self.truncate_penalty = config['openrave_rl']['truncate_penalty']
 
+        use_occupancy_grid = False
+        if 'use_occupancy_grid' in config['openrave_rl']:
+            use_occupancy_grid = config['openrave_rl']['use_occupancy_grid']
         self.openrave_manager = OpenraveManager(
-            config['openrave_rl']['segment_validity_step'], PotentialPoint.from_config(config))
+            config['openrave_rl']['segment_validity_step'], PotentialPoint.from_config(config), use_occupancy_grid)
 
         self.current_joints = None
         self.goal_joints = None
@@ -88,6 +91,47 @@ class OpenraveRLInterface:
         # else, just a normal step...
         return self._get_step_result(next_joints, -self.keep_alive_penalty + reward, False, 1)
 
+    def step_batch(self, current_joints, goal_joints, joints_actions):
+        # the result of step for every row (of independent start, goal and action), as arrays
+        step = joints_actions * self.action_step_size
+        next_joints_before_truncate = current_joints + step
+        next_joints = self.openrave_manager.truncate_joints_batch(next_joints_before_truncate)
+
+        rewards = np.zeros(len(current_joints))
+        if self.truncate_penalty > 0.0:
+            rewards -= self.truncate_penalty * np.linalg.norm(
+                next_joints_before_truncate - next_joints, axis=1) / self.action_step_size
+
+        status = np.ones(len(current_joints), dtype=np.int8)
+        is_collision = np.logical_not(self.openrave_manager.check_segments_validity(current_joints, next_joints))
+        status[is_collision] = 2
+        # the goal distance is only relevant to the steps that did not collide
+        free = np.where(np.logical_not(is_collision))[0]
+        if len(free) > 0:
+            pose_distance = np.linalg.norm(
+                self.openrave_manager.get_target_poses(next_joints[free]) -
+                self.openrave_manager.get_target_poses(goal_joints[free]), axis=1
+            )
+            status[free[pose_distance < self.goal_sensitivity]] = 3
+        rewards += np.select([status == 2, status == 3], [-1.0, 1.0], -self.keep_alive_penalty)
+        return next_joints, rewards, status != 1, status
+
+    def get_random_steps(self, number_of_steps):
+        # random actions from random free start joints towards random free goal joints in the loaded workspace, the
+        # same transitions as a random action after start_specific([start_joints, goal_joints]). returns a dictionary
+        # of arrays (the fields of reward_data_columns)
+        start_joints = self.openrave_manager.get_random_valid_joints_batch(number_of_steps, {0: 0.0})
+        goal_joints = self.openrave_manager.get_random_valid_joints_batch(number_of_steps, {0: 0.0})
+        random_actions = np.random.uniform(-1.0, 1.0, (number_of_steps, start_joints.shape[1] - 1))
+        random_actions /= np.linalg.norm(random_actions, axis=1, keepdims=True)
+        random_actions = np.concatenate((np.zeros((number_of_steps, 1)), random_actions), axis=1)
+        next_joints, rewards, terminated, status = self.step_batch(start_joints, goal_joints, random_actions)
+        return {
+            'start_joints': start_joints, 'goal_joints': goal_joints, 'action': random_actions,
+            'next_joints': next_joints, 'reward': rewards, 'terminated': terminated, 'status': status,
+            'goal_pose': self.openrave_manager.get_target_poses(goal_joints),
+        }
+
     def _get_step_result(self, next_joints, reward, is_terminal, enum_res):
         if is_terminal:
             self.current_joints = None
@@ -1,21 +1,34 @@
+import time
 import numpy as np
 from openrave_manager import OpenraveManager
+from planner_budget import PlannerBudget
 from potential_point import PotentialPoint
 
 
 class OpenraveTrajectoryGenerator:
 
-    def __init__(self, config):
+    def __init__(self, config, planner_budget=None):
         self.action_step_size = config['openrave_rl']['action_step_size']
         self.goal_sensitivity = config['openrave_rl']['goal_sensitivity']
         self.challenging_trajectories_only = config['openrave_planner']['challenging_trajectories_only']
-        self.planner_iterations_start = config['openrave_planner']['planner_iterations_start']
-        self.planner_iterations_increase = config['openrave_planner']['planner_iterations_increase']
-        self.planner_iterations_decrease = config['openrave_planner']['planner_iterations_decrease']
-        self.max_planner_iterations = self.planner_iterations_start
+        # the budget may be shared with other generators (see DataCollector)
+        if planner_budget is None:
+            planner_budget = PlannerBudget.from_config(config)
+        self.planner_budget = planner_budget
 
+        use_occupancy_grid = False
+        if 'use_occupancy_grid' in config['openrave_rl']:
+            use_occupancy_grid = config['openrave_rl']['use_occupancy_grid']
         self.openrave_manager = OpenraveManager(
-            config['openrave_rl']['segment_validity_step'], PotentialPoint.from_config(config))
+            config['openrave_rl']['segment_validity_step'], PotentialPoint.from_config(config), use_occupancy_grid)
+
+        # start and goal pairs that passed the screening, for the currently loaded workspace
+        self.candidates = []
+        self.candidates_params_path = None
+        self.candidates_batch_size = 100
+        # seeded from the os when the generator is created, so generators in forked processes never share a sequence
+        # even if numpy's global state was copied from the parent
+        self.random_state = np.random.RandomState()
 
     def is_below_goal_sensitivity(self, start_joints, goal_joints):
         start_pose = self.openrave_manager.get_target_pose(start_joints)
@@ -23,80 +36,69 @@ class OpenraveTrajectoryGenerator:
         pose_distance = np.linalg.norm(np.array(start_pose) - np.array(goal_pose))
         return pose_distance < self.goal_sensitivity
 
-    def find_random_trajectory_single_try(self):
-        # select at random
-        start_joints = self.openrave_manager.get_random_joints({0: 0.0})
-        goal_joints = self.openrave_manager.get_random_joints({0: 0.0})
+    def _get_candidates(self):
+        # samples a batch of start and goal pairs and screens all of them together, before spending planner time
+        openrave_manager = self.openrave_manager
+        start_joints = openrave_manager.get_random_joints_batch(self.candidates_batch_size, {0: 0.0}, self.random_state)
+        goal_joints = openrave_manager.get_random_joints_batch(self.candidates_batch_size, {0: 0.0}, self.random_state)
+        start_poses = openrave_manager.get_target_poses(start_joints)
+        goal_poses = openrave_manager.get_target_poses(goal_joints)
+        start_goal_distances = np.linalg.norm(start_poses - goal_poses, axis=1)
         # if the start and goal are too close, re-sample
-        if self.is_below_goal_sensitivity(start_joints, goal_joints):
-            return None
-        start_pose = self.openrave_manager.get_target_pose(start_joints)
-        goal_pose = self.openrave_manager.get_target_pose(goal_joints)
+        is_candidate = start_goal_distances >= self.goal_sensitivity
         # valid region:
-        if not self._is_valid_region(start_pose, goal_pose):
-            return None
+        is_candidate &= np.logical_and(start_poses[:, 1] > 0.0, goal_poses[:, 1] > 0.0)
         # trajectories that must cross an obstacle
-        if self.challenging_trajectories_only and not self._is_challenging(start_pose, goal_pose):
-            return None
-        traj = self.openrave_manager.plan(start_joints, goal_joints, self.max_planner_iterations)
+        if self.challenging_trajectories_only:
+            is_candidate &= self._are_challenging(start_poses, goal_poses, start_goal_distances)
+        candidates = np.where(is_candidate)[0]
+        # the planner fails right away on invalid start or goal joints
+        candidates = candidates[np.logical_and(
+            openrave_manager.are_valid(start_joints[candidates]), openrave_manager.are_valid(goal_joints[candidates])
+        )]
+        return [(tuple(start_joints[i]), tuple(goal_joints[i])) for i in candidates]
+
+    def _next_candidate(self):
+        if self.candidates_params_path != self.openrave_manager.loaded_params_path:
+            # the workspace changed
+            self.candidates = []
+            self.candidates_params_path = self.openrave_manager.loaded_params_path
+        while len(self.candidates) == 0:
+            self.candidates = self._get_candidates()
+        return self.candidates.pop()
+
+    def find_random_trajectory_single_try(self):
+        start_joints, goal_joints = self._next_candidate()
+        planning_start = time.time()
+        traj = self.openrave_manager.plan(start_joints, goal_joints, self.planner_budget.max_planner_iterations)
+        self.planner_budget.report(traj is not None, time.time() - planning_start)
         return traj
 
     def find_random_trajectory(self):
+        return self.find_random_trajectory_with_poses()[0]
+
+    def find_random_trajectory_with_poses(self):
+        # returns the trajectory split to action steps, and the potential points poses of every step
         # lower_size = 0.0  # when doing curriculum, this this is the lowest possible distance between start and goal
         while True:
             traj = self.find_random_trajectory_single_try()
-            if traj is None:
-                # if failed to plan, give more power
-                self.max_planner_iterations += self.planner_iterations_increase
-            elif self.max_planner_iterations > self.planner_iterations_start + self.planner_iterations_decrease:
-                # if plan was found, maybe we need less iterations
-                self.max_planner_iterations -= self.planner_iterations_decrease
-                return self.split_trajectory(traj, self.action_step_size)
-
-    @staticmethod
-    def _is_valid_region(start_pose, goal_pose):
-        return start_pose[1] > 0.0 and goal_pose[1] > 0.0
+            # the budget was already adapted by the result, every plan found is used
+            if traj is not None:
+                return self.openrave_manager.process_path(traj, self.action_step_size)
 
-    def _is_challenging(self, start_pose, goal_pose):
+    def _are_challenging(self, start_poses, goal_poses, start_goal_distances):
         workspace_params = self.openrave_manager.loaded_params
         if workspace_params is None or workspace_params.number_of_obstacles == 0:
-            return True
+            return np.ones(len(start_poses), dtype=bool)
         # check if the distance from any obstacle is smaller that the start-goal-distance
-        start = np.array(start_pose)
-        goal = np.array(goal_pose)
-        start_goal_distance = np.linalg.norm(start - goal)
-        for i in range(workspace_params.number_of_obstacles):
-            obstacle = np.array(
-                [workspace_params.centers_position_x[i], workspace_params.centers_position_z[i]]
-            )
-            start_obstacle_distance = np.linalg.norm(start - obstacle)
-            goal_obstacle_distance = np.linalg.norm(goal - obstacle)
-            if start_obstacle_distance < start_goal_distance and goal_obstacle_distance < start_goal_distance:
-                return True
-        # all tests failed
-        return False
+        obstacles = np.array([workspace_params.centers_position_x, workspace_params.centers_position_z]).transpose()
+        start_obstacle_distances = np.linalg.norm(start_poses[:, None, :] - obstacles[None, :, :], axis=2)
+        goal_obstacle_distances = np.linalg.norm(goal_poses[:, None, :] - obstacles[None, :, :], axis=2)
+        start_goal_distances = start_goal_distances[:, None]
+        return np.any(np.logical_and(
+            start_obstacle_distances < start_goal_distances, goal_obstacle_distances < start_goal_distances
+        ), axis=1)
 
     @staticmethod
     def split_trajectory(trajectory, action_step_size):
-        res = [tuple(trajectory[0])]
-        for i in range(len(trajectory) - 1):
-            current_step = np.array(trajectory[i])
-            next_step = np.array(trajectory[i + 1])
-            difference = next_step - current_step
-            difference_norm = np.linalg.norm(difference)
-            if difference_norm < action_step_size:
-                # if smaller than allowed step just append the next step
-                res.append(tuple(trajectory[i + 1]))
-                continue
-            scaled_step = (action_step_size / difference_norm) * difference
-            steps = []
-            for alpha in range(int(np.floor(difference_norm / action_step_size))):
-                processed_step = current_step + (1 + alpha) * scaled_step
-                steps.append(processed_step)
-            # we probably have a leftover section, append it to res
-            last_step_difference = np.linalg.norm(steps[-1] - next_step)
-            if last_step_difference > 0.0:
-                steps.append(next_step)
-            # append to path
-            res += [tuple(s) for s in steps]
-        return res
+        return [tuple(s) for s in OpenraveManager.resample_path(trajectory, action_step_size)]
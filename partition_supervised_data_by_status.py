@@ -1,54 +1,136 @@
 import os
+import sys
 import bz2
+import json
+import multiprocessing
 import cPickle as pickle
 
-# source_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision/train'
-# source_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision/test'
-# source_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_harder_shuffled/test'
-source_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_harder_shuffled/train'
-# target_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_by_status/train'
-# target_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_by_status/test'
-# target_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_harder_by_status/test'
-target_dir = '/home/tom/ModelBasedDDPG/supervised_data/vision_harder_by_status/train'
-file_max_size = 1000
+from prefetch_pipeline import PrefetchPipeline
 
-assert os.path.isdir(source_dir)
+# splits a directory of supervised reward data files into files of a single status ('<status>_<index>.pkl'). the input
+# files are read in parallel, every status has a fixed size buffer and every full buffer is compressed and written in
+# the background. the manifest lists the files and the number of transitions of every status, so the loaders do not
+# need to scan (or read) the files.
+STATUSES = [1, 2, 3]
+MANIFEST_FILENAME = 'partition_manifest.json'
 
-if not os.path.exists(target_dir):
-    os.makedirs(target_dir)
 
+def load_manifest(data_dir):
+    # returns None if the directory was not created by partition
+    manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    # json keys are strings
+    manifest['statuses'] = {int(status): value for status, value in manifest['statuses'].items()}
+    return manifest
 
-data_by_status = {1: [], 2: [], 3: []}
-index_counters = {1: 0, 2: 0, 3: 0}
 
+def _load_compressed(path):
+    with bz2.BZ2File(path, 'r') as compressed_file:
+        return pickle.load(compressed_file)
 
-def write_data(force_write=False):
-    for status in data_by_status:
-        if len(data_by_status[status]) > file_max_size or force_write:
-            target_file_path = os.path.join(target_dir, '{}_{}.pkl'.format(status, index_counters[status]))
-            print 'writing status file for {} to {}'.format(status, target_file_path)
-            data_to_write = data_by_status[status][:file_max_size]
-            with bz2.BZ2File(target_file_path, 'w') as compressed_file:
-                pickle.dump(data_to_write, compressed_file)
-            print 'done writing {}'.format(target_file_path)
-            # advance the data to not write the same data twice
-            data_by_status[status] = data_by_status[status][file_max_size:]
-            index_counters[status] += 1
 
+def _write_compressed(path, data):
+    with bz2.BZ2File(path + '.tmp', 'w') as compressed_file:
+        pickle.dump(data, compressed_file)
+    os.rename(path + '.tmp', path)
+    return path
 
-for dirpath, dirnames, filenames in os.walk(source_dir):
-    data_files = [f for f in filenames if f.endswith('.pkl')]
 
-    for i, data_file in enumerate(data_files):
-        full_path = os.path.join(source_dir, data_file)
-        print 'starting {}: {}'.format(i, full_path)
-        with bz2.BZ2File(full_path, 'r') as compressed_file:
-            content = pickle.load(compressed_file)
-        for transition in content:
-            data_by_status[transition[-1]].append(transition)
-        print 'done reading {}: {}'.format(i, full_path)
+class _StatusWriter:
+    def __init__(self, status, target_dir, file_max_size, write_pool, max_pending_writes):
+        self.status = status
+        self.target_dir = target_dir
+        self.write_pool = write_pool
+        self.max_pending_writes = max_pending_writes
+        self.buffer = [None] * file_max_size
+        self.buffered = 0
+        self.files = []
+        self.count = 0
+        self.pending_writes = []
 
-        write_data()
-    write_data(True)
+    def add(self, transition):
+        self.buffer[self.buffered] = transition
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
 
+    def flush(self):
+        if self.buffered == 0:
+            return
+        filename = '{}_{}.pkl'.format(self.status, len(self.files))
+        data = self.buffer[:self.buffered]
+        self.pending_writes.append(
+            self.write_pool.apply_async(_write_compressed, (os.path.join(self.target_dir, filename), data)))
+        self.files.append(filename)
+        self.count += self.buffered
+        self.buffered = 0
+        # bounds the memory held by the writes in progress
+        while len(self.pending_writes) > self.max_pending_writes:
+            print 'done writing {}'.format(self.pending_writes.pop(0).get())
 
+    def wait(self):
+        while len(self.pending_writes) > 0:
+            print 'done writing {}'.format(self.pending_writes.pop(0).get())
+
+
+def partition(source_dir, target_dir, file_max_size=1000, readers=None, writers=None):
+    assert os.path.isdir(source_dir)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    if readers is None:
+        readers = max(1, multiprocessing.cpu_count() / 2)
+    if writers is None:
+        writers = max(1, multiprocessing.cpu_count() / 2)
+
+    data_files = sorted([os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.endswith('.pkl')])
+    reader = PrefetchPipeline(readers, 2 * readers, load_function=_load_compressed)
+    write_pool = multiprocessing.Pool(writers)
+    status_writers = {
+        status: _StatusWriter(status, target_dir, file_max_size, write_pool, 2 * writers) for status in STATUSES
+    }
+    try:
+        for i, content in enumerate(reader.iterate(data_files)):
+            for transition in content:
+                status_writers[transition[-1]].add(transition)
+            print 'done reading {} of {}'.format(i + 1, len(data_files))
+        for status in STATUSES:
+            status_writers[status].flush()
+        for status in STATUSES:
+            status_writers[status].wait()
+    finally:
+        reader.end()
+        write_pool.close()
+        write_pool.join()
+
+    manifest = {
+        'source_dir': source_dir,
+        'file_max_size': file_max_size,
+        'statuses': {
+            status: {'count': status_writers[status].count, 'files': status_writers[status].files}
+            for status in STATUSES
+        },
+    }
+    manifest_path = os.path.join(target_dir, MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(manifest_path + '.tmp', manifest_path)
+    for status in STATUSES:
+        print 'status {}: {} transitions in {} files'.format(
+            status, status_writers[status].count, len(status_writers[status].files))
+
+
+if __name__ == '__main__':
+    # usage: python partition_supervised_data_by_status.py [source_dir target_dir [file_max_size]]
+    if len(sys.argv) > 2:
+        source_dir = os.path.expanduser(sys.argv[1])
+        target_dir = os.path.expanduser(sys.argv[2])
+    else:
+        # source_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_shuffled/test')
+        source_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_shuffled/train')
+        # target_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_by_status/test')
+        target_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_by_status/train')
+    file_max_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    partition(source_dir, target_dir, file_max_size)
@@ -0,0 +1,134 @@
+import collections
+import hashlib
+import os
+import cPickle as pickle
+import numpy as np
+
+# a persistent cache of the motion plans, shared by all the processes that use the same directory. the plans are stored
+# in buckets by workspace and quantized goal joints, the workspace is identified by its obstacles (not by the params
+# file, which may be regenerated). a query is answered from a cached plan to (almost) the same goal that passes close
+# enough to the query start: the start is connected to the closest state of the plan, and the end of the plan is
+# connected to the exact goal (the entire resulting path is validated). the buckets are kept in memory in a LRU order,
+# and the least recently used buckets are removed from the disk when there are too many.
+
+
+class PlanCache:
+    def __init__(self, cache_dir, resolution, connect_distance, plans_per_bucket=10, max_memory_buckets=1000,
+                 max_disk_buckets=100000):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.resolution = resolution
+        self.connect_distance = connect_distance
+        self.plans_per_bucket = plans_per_bucket
+        self.max_memory_buckets = max_memory_buckets
+        self.max_disk_buckets = max_disk_buckets
+        self.buckets = collections.OrderedDict()
+        self.writes_since_eviction = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_config(config):
+        plan_cache_config = config['plan_cache']
+        return PlanCache(
+            os.path.abspath(os.path.expanduser(plan_cache_config['directory'])), plan_cache_config['resolution'],
+            plan_cache_config['connect_distance'], plan_cache_config['plans_per_bucket'],
+            plan_cache_config['max_memory_buckets'], plan_cache_config['max_disk_buckets']
+        )
+
+    @staticmethod
+    def get_workspace_key(workspace_params):
+        obstacles = [
+            [float(v) for v in values] for values in [
+                workspace_params.centers_position_x, workspace_params.centers_position_z, workspace_params.sides_x,
+                workspace_params.sides_z, workspace_params.y_axis_rotation
+            ]
+        ]
+        return hashlib.md5(repr((int(workspace_params.number_of_obstacles), obstacles))).hexdigest()
+
+    def _get_bucket_filename(self, workspace_key, goal_joints):
+        goal_key = tuple(np.round(np.array(goal_joints) / self.resolution).astype(np.int64))
+        return hashlib.md5(repr((workspace_key, goal_key))).hexdigest() + '.plans'
+
+    def _load_bucket(self, bucket_filename):
+        if bucket_filename in self.buckets:
+            plans = self.buckets.pop(bucket_filename)
+        else:
+            bucket_path = os.path.join(self.cache_dir, bucket_filename)
+            try:
+                with open(bucket_path, 'rb') as bucket_file:
+                    plans = pickle.load(bucket_file)
+                # the modification time is the LRU order on the disk
+                os.utime(bucket_path, None)
+            except (IOError, OSError, EOFError):
+                plans = []
+        self.buckets[bucket_filename] = plans
+        while len(self.buckets) > self.max_memory_buckets:
+            self.buckets.popitem(last=False)
+        return plans
+
+    def _write_bucket(self, bucket_filename, plans):
+        bucket_path = os.path.join(self.cache_dir, bucket_filename)
+        # other processes may write the same bucket
+        temporary_path = '{}.{}.tmp'.format(bucket_path, os.getpid())
+        with open(temporary_path, 'wb') as bucket_file:
+            pickle.dump(plans, bucket_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_path, bucket_path)
+        self.writes_since_eviction += 1
+        if self.writes_since_eviction >= max(1, self.max_disk_buckets / 100):
+            self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        self.writes_since_eviction = 0
+        bucket_paths = [
+            os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.plans')
+        ]
+        if len(bucket_paths) <= self.max_disk_buckets:
+            return
+        modification_times = []
+        for bucket_path in bucket_paths:
+            try:
+                modification_times.append(os.path.getmtime(bucket_path))
+            except OSError:
+                modification_times.append(0.0)
+        for i in np.argsort(modification_times)[:len(bucket_paths) - self.max_disk_buckets]:
+            try:
+                os.remove(bucket_paths[i])
+            except OSError:
+                # already removed by another process
+                pass
+
+    def get(self, workspace_key, start_joints, goal_joints, openrave_manager):
+        # returns a valid plan (list of joints) from start_joints to goal_joints, or None
+        plans = self._load_bucket(self._get_bucket_filename(workspace_key, goal_joints))
+        start = np.array(start_joints)
+        goal = np.array(goal_joints)
+        for plan in plans:
+            distances = np.linalg.norm(plan - start, axis=1)
+            closest = np.argmin(distances)
+            if distances[closest] > self.connect_distance:
+                continue
+            result = [list(s) for s in plan[closest:]]
+            if distances[closest] > 0.0:
+                result.insert(0, list(start_joints))
+            if np.linalg.norm(plan[-1] - goal) > 0.0:
+                result.append(list(goal_joints))
+            # the exact start and goal joints
+            result[0], result[-1] = list(start_joints), list(goal_joints)
+            # the connections and the cached states are all validated in the current workspace
+            if not openrave_manager.is_path_valid(result):
+                continue
+            self.hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def put(self, workspace_key, goal_joints, plan):
+        bucket_filename = self._get_bucket_filename(workspace_key, goal_joints)
+        # merge with the plans other processes wrote to the same bucket
+        self.buckets.pop(bucket_filename, None)
+        plans = self._load_bucket(bucket_filename)
+        plans.append(np.array(plan))
+        del plans[:-self.plans_per_bucket]
+        self._write_bucket(bucket_filename, plans)
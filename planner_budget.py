@@ -0,0 +1,61 @@
+import multiprocessing
+
+
+class PlannerBudget:
+    # the adaptive number of planner iterations (more after a failure, less after a success), in shared memory so all
+    # the collectors of a pool adapt a single budget. also records the planner statistics of the pool, and prints them
+    # every log_every attempts (none if None).
+    def __init__(self, planner_iterations_start, planner_iterations_increase, planner_iterations_decrease,
+                 log_every=None):
+        self.planner_iterations_start = planner_iterations_start
+        self.planner_iterations_increase = planner_iterations_increase
+        self.planner_iterations_decrease = planner_iterations_decrease
+        self.log_every = log_every
+        self.lock = multiprocessing.Lock()
+        self._max_planner_iterations = multiprocessing.Value('i', planner_iterations_start, lock=False)
+        # attempts, successes, total planning time (seconds)
+        self._statistics = multiprocessing.Array('d', 3, lock=False)
+
+    @staticmethod
+    def from_config(config):
+        planner_config = config['openrave_planner']
+        log_every = planner_config['log_every'] if 'log_every' in planner_config else None
+        return PlannerBudget(
+            planner_config['planner_iterations_start'], planner_config['planner_iterations_increase'],
+            planner_config['planner_iterations_decrease'], log_every
+        )
+
+    @property
+    def max_planner_iterations(self):
+        return self._max_planner_iterations.value
+
+    def report(self, is_successful, planning_time):
+        with self.lock:
+            self._statistics[0] += 1
+            self._statistics[2] += planning_time
+            if not is_successful:
+                # if failed to plan, give more power
+                self._max_planner_iterations.value += self.planner_iterations_increase
+            else:
+                self._statistics[1] += 1
+                if self._max_planner_iterations.value > \
+                        self.planner_iterations_start + self.planner_iterations_decrease:
+                    # if plan was found, maybe we need less iterations
+                    self._max_planner_iterations.value -= self.planner_iterations_decrease
+            attempts = int(self._statistics[0])
+        if self.log_every is not None and attempts % self.log_every == 0:
+            print 'planner statistics: {}'.format(self.get_statistics())
+
+    def get_statistics(self):
+        with self.lock:
+            attempts, successes, planning_time = self._statistics[:]
+            max_planner_iterations = self._max_planner_iterations.value
+        return {
+            'attempts': int(attempts),
+            'successes': int(successes),
+            'success_rate': successes / attempts if attempts > 0 else 0.0,
+            'time_per_attempt': planning_time / attempts if attempts > 0 else 0.0,
+            # including the time of the failed attempts
+            'time_per_plan': planning_time / successes if successes > 0 else 0.0,
+            'max_planner_iterations': max_planner_iterations,
+        }
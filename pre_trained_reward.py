@@ -31,13 +31,13 @@ class PreTrainedReward:
         self.reward_prediction, self.status_softmax_logits = self.create_reward_network(
             self.joints_inputs, self.action_inputs, self.goal_joints_inputs, self.goal_pose_inputs, self.images_3d
         )
-        reward_variables = tf.trainable_variables()[current_variables_count:]
+        self.reward_variables = tf.trainable_variables()[current_variables_count:]
 
         # model path to load
         self.model_name = model_name
         self.saver_dir = os.path.join(os.getcwd(), 'data', 'reward', 'model', model_name)
         assert os.path.exists(self.saver_dir)
-        self.saver = tf.train.Saver(reward_variables, max_to_keep=4, save_relative_paths=self.saver_dir)
+        self.saver = tf.train.Saver(self.reward_variables, max_to_keep=4, save_relative_paths=self.saver_dir)
 
     @staticmethod
     def _generate_goal_features(goal_joints_inputs, goal_pose_inputs):
@@ -115,6 +115,10 @@ class PreTrainedReward:
     def load_weights(self, sess):
         self.saver.restore(sess, tf.train.latest_checkpoint(self.saver_dir))
 
+    def get_weights(self, sess):
+        # the reward variables in creation order (see numpy_reward.NumpyReward)
+        return sess.run(self.reward_variables)
+
     def make_prediction(self, sess, all_start_joints, all_goal_joints, all_actions, all_goal_poses,
                         all_transition_labels=None, images=None):
         feed = self.make_feed(all_start_joints, all_goal_joints, all_actions, all_goal_poses, images=images,
@@ -0,0 +1,90 @@
+import cPickle as pickle
+import multiprocessing
+import Queue
+import traceback
+
+
+def load_pickle(path):
+    with open(path, 'r') as source_file:
+        return pickle.load(source_file)
+
+
+class _PrefetchWorker(multiprocessing.Process):
+    def __init__(self, load_function, tasks_queue, results_queue, current_epoch):
+        multiprocessing.Process.__init__(self)
+        self.load_function = load_function
+        self.tasks_queue = tasks_queue
+        self.results_queue = results_queue
+        self.current_epoch = current_epoch
+
+    def run(self):
+        while True:
+            task = self.tasks_queue.get()
+            if task is None:
+                # the shutdown sentinel
+                break
+            epoch, item = task
+            if epoch != self.current_epoch.value:
+                # the iteration that requested the item was abandoned
+                continue
+            try:
+                result = (epoch, True, self.load_function(item))
+            except Exception:
+                result = (epoch, False, traceback.format_exc())
+            # blocks while the pipeline is full
+            self.results_queue.put(result)
+
+
+class PrefetchPipeline:
+    # loads items (files by default) in worker processes, every result is pushed into a queue of at most depth results
+    # as soon as there is room in it. results arrive in the order they were loaded.
+    def __init__(self, number_of_workers, depth, load_function=load_pickle):
+        self.tasks_queue = multiprocessing.Queue()
+        self.results_queue = multiprocessing.Queue(maxsize=depth)
+        self.current_epoch = multiprocessing.Value('i', 0)
+        self.workers = [
+            _PrefetchWorker(load_function, self.tasks_queue, self.results_queue, self.current_epoch)
+            for _ in range(number_of_workers)
+        ]
+        for w in self.workers:
+            w.daemon = True
+            w.start()
+
+    def iterate(self, items):
+        # a new iteration abandons the previous one (if it was not completed), stale results are discarded
+        with self.current_epoch.get_lock():
+            self.current_epoch.value += 1
+            epoch = self.current_epoch.value
+        for item in items:
+            self.tasks_queue.put((epoch, item))
+        received = 0
+        while received < len(items):
+            result_epoch, is_successful, result = self.results_queue.get()
+            if result_epoch != epoch:
+                continue
+            if not is_successful:
+                raise Exception('prefetch worker failed:\n{}'.format(result))
+            received += 1
+            yield result
+
+    def end(self, timeout=10.0):
+        # abandon the current iteration and post a sentinel per worker
+        with self.current_epoch.get_lock():
+            self.current_epoch.value += 1
+        for _ in self.workers:
+            self.tasks_queue.put(None)
+        for w in self.workers:
+            # drain the results, a worker may be blocked on a full queue
+            while w.is_alive():
+                try:
+                    self.results_queue.get(block=True, timeout=0.1)
+                except Queue.Empty:
+                    pass
+                w.join(timeout=0.1)
+                timeout -= 0.2
+                if timeout <= 0.0:
+                    break
+        for w in self.workers:
+            if w.is_alive():
+                w.terminate()
+            w.join()
@@ -0,0 +1,232 @@
+import bz2
+import cPickle as pickle
+import json
+import os
+import numpy as np
+
+# the supervised reward data in a columnar format: a directory per status (1 free, 2 collision, 3 goal) holding one .npy
+# file per field per chunk ('<field>_<chunk index>.npy'), and a meta.json with the chunk lengths of every status, the
+# workspace ids (the workspace field indexes this list, -1 if there is no workspace) and the potential point the goal
+# poses were computed for.
+FIELDS = [
+    ('start_joints', np.float32), ('goal_joints', np.float32), ('action', np.float32), ('next_joints', np.float32),
+    ('reward', np.float32), ('terminated', np.bool_), ('status', np.int8), ('goal_pose', np.float32),
+    ('workspace', np.int32),
+]
+STATUSES = [1, 2, 3]
+META_FILENAME = 'meta.json'
+
+
+def _get_chunk_path(data_dir, status, field, chunk_index):
+    return os.path.join(data_dir, str(status), '{}_{}.npy'.format(field, chunk_index))
+
+
+def _save_atomically(path, array):
+    with open(path + '.tmp', 'wb') as target_file:
+        np.save(target_file, array)
+    os.rename(path + '.tmp', path)
+
+
+def load_meta(data_dir):
+    with open(os.path.join(data_dir, META_FILENAME), 'r') as meta_file:
+        meta = json.load(meta_file)
+    # json keys are strings
+    meta['chunk_lengths'] = {int(status): lengths for status, lengths in meta['chunk_lengths'].items()}
+    return meta
+
+
+def get_counts(data_dir):
+    # the number of transitions of every status, without reading the data
+    meta = load_meta(data_dir)
+    return {status: sum(lengths) for status, lengths in meta['chunk_lengths'].items()}
+
+
+class ColumnarWriter:
+    def __init__(self, target_dir, potential_point, chunk_size=100000):
+        self.target_dir = target_dir
+        self.potential_point = potential_point
+        self.chunk_size = chunk_size
+        for status in STATUSES:
+            status_dir = os.path.join(target_dir, str(status))
+            if not os.path.exists(status_dir):
+                os.makedirs(status_dir)
+        self.chunk_lengths = {status: [] for status in STATUSES}
+        self.workspaces = []
+        self._workspace_indices = {}
+        # the buffered columns of every status, and their total length
+        self._buffers = {status: [] for status in STATUSES}
+        self._buffered_lengths = {status: 0 for status in STATUSES}
+
+    def _get_workspace_index(self, workspace_id):
+        if workspace_id is None:
+            return -1
+        if workspace_id not in self._workspace_indices:
+            self._workspace_indices[workspace_id] = len(self.workspaces)
+            self.workspaces.append(workspace_id)
+        return self._workspace_indices[workspace_id]
+
+    def add(self, transitions, goal_poses):
+        # transitions are tuples of (workspace_id, )start_joints, goal_joints, action, next_joints, reward, terminated,
+        # status (workspace_id only for vision)
+        if len(transitions) == 0:
+            return
+        rows = []
+        for transition, goal_pose in zip(transitions, goal_poses):
+            workspace_id = transition[0] if len(transition) == 8 else None
+            rows.append(tuple(transition[-7:]) + (goal_pose, self._get_workspace_index(workspace_id)))
+        columns = zip(*rows)
+        self.add_columns({field: np.array(columns[i], dtype=dtype) for i, (field, dtype) in enumerate(FIELDS)})
+
+    def add_columns(self, columns, workspace_id=None):
+        # columns is a dictionary from field to an array of rows of any status. if the workspace field is missing, all
+        # the rows are of workspace_id
+        if 'workspace' not in columns:
+            columns = dict(columns)
+            columns['workspace'] = np.full(len(columns['status']), self._get_workspace_index(workspace_id), np.int32)
+        for status in STATUSES:
+            is_status = np.asarray(columns['status']) == status
+            length = np.count_nonzero(is_status)
+            if length == 0:
+                continue
+            self._buffers[status].append({
+                field: np.asarray(columns[field])[is_status].astype(dtype) for field, dtype in FIELDS
+            })
+            self._buffered_lengths[status] += length
+            while self._buffered_lengths[status] >= self.chunk_size:
+                self._write_chunk(status, self.chunk_size)
+
+    def _write_chunk(self, status, length=None):
+        if self._buffered_lengths[status] == 0:
+            return
+        if length is None:
+            length = self._buffered_lengths[status]
+        buffered = {
+            field: np.concatenate([columns[field] for columns in self._buffers[status]]) for field, _ in FIELDS
+        }
+        self._write_columns(status, {field: buffered[field][:length] for field, _ in FIELDS})
+        self._buffered_lengths[status] -= length
+        self._buffers[status] = []
+        if self._buffered_lengths[status] > 0:
+            self._buffers[status].append({field: buffered[field][length:] for field, _ in FIELDS})
+
+    def _write_columns(self, status, columns):
+        chunk_index = len(self.chunk_lengths[status])
+        for field, _ in FIELDS:
+            _save_atomically(_get_chunk_path(self.target_dir, status, field, chunk_index), columns[field])
+        self.chunk_lengths[status].append(len(columns['status']))
+
+    def close(self):
+        for status in STATUSES:
+            self._write_chunk(status)
+        meta = {
+            'chunk_lengths': self.chunk_lengths,
+            'workspaces': self.workspaces,
+            'potential_point': list(self.potential_point),
+        }
+        meta_path = os.path.join(self.target_dir, META_FILENAME)
+        with open(meta_path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.rename(meta_path + '.tmp', meta_path)
+
+
+class ColumnarRewardData:
+    # memory maps the chunks of a single status, batches are gathered from the mapped arrays
+    def __init__(self, data_dir, status, potential_point=None):
+        self.data_dir = data_dir
+        self.status = status
+        meta = load_meta(data_dir)
+        if potential_point is not None:
+            # the goal poses are only valid for the potential point they were computed for
+            assert list(potential_point) == meta['potential_point']
+        self.workspaces = meta['workspaces']
+        chunk_lengths = meta['chunk_lengths'][status]
+        self.offsets = np.cumsum([0] + chunk_lengths)
+        self.chunks = [
+            {field: np.load(_get_chunk_path(data_dir, status, field, i), mmap_mode='r') for field, _ in FIELDS}
+            for i in range(len(chunk_lengths))
+        ]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, indices):
+        # returns a dictionary from field to the rows at indices (in the given order)
+        indices = np.asarray(indices, dtype=np.int64)
+        chunk_indices = np.searchsorted(self.offsets, indices, side='right') - 1
+        result = {}
+        for field, dtype in FIELDS:
+            shape = self.chunks[0][field].shape[1:] if len(self.chunks) > 0 else ()
+            result[field] = np.zeros((len(indices), ) + shape, dtype=dtype)
+        for chunk_index in np.unique(chunk_indices):
+            positions = np.where(chunk_indices == chunk_index)[0]
+            # reading the rows in order keeps the access to the mapped file sequential
+            rows = indices[positions] - self.offsets[chunk_index]
+            order = np.argsort(rows)
+            positions, rows = positions[order], rows[order]
+            for field, _ in FIELDS:
+                result[field][positions] = self.chunks[chunk_index][field][rows]
+        return result
+
+    def iterate_batches(self, batch_size, shuffle=True):
+        indices = np.random.permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(indices), batch_size):
+            yield self.gather(indices[start: start + batch_size])
+
+    def get_images(self, workspace_indices, image_cache):
+        # every distinct workspace image is fetched once
+        unique_indices, inverse = np.unique(workspace_indices, return_inverse=True)
+        images = np.array([image_cache.get_image(self.workspaces[i]) for i in unique_indices])
+        return images[inverse]
+
+
+def get_batch_and_labels(columns, reward_data, image_cache=None):
+    # same outputs as pre_trained_reward.get_batch_and_labels, as arrays (joints without the first joint). the
+    # workspaces are shared by all the statuses, so reward_data can be any of the ColumnarRewardData of the directory
+    images = None
+    if image_cache is not None:
+        images = reward_data.get_images(columns['workspace'], image_cache)
+    return [
+        columns['start_joints'][:, 1:], columns['goal_joints'][:, 1:], columns['action'][:, 1:], columns['goal_pose'],
+        images
+    ], columns['reward'], columns['status'].astype(np.int32)
+
+
+def _load_transitions(path):
+    # the source files are either bz2 compressed or plain pickles (the cache of RewardDataLoader)
+    with open(path, 'rb') as source_file:
+        is_compressed = source_file.read(3) == 'BZh'
+    source_file = bz2.BZ2File(path, 'r') if is_compressed else open(path, 'rb')
+    try:
+        return pickle.load(source_file)
+    finally:
+        source_file.close()
+
+
+def convert_to_columns(source_dir, target_dir, openrave_manager, chunk_size=100000):
+    # one time conversion of a directory of pickled transition lists (the supervised data, split by status or not)
+    writer = ColumnarWriter(target_dir, openrave_manager.potential_points[-1].tuple, chunk_size)
+    files = sorted([f for f in os.listdir(source_dir) if f.endswith('.pkl')])
+    for i, f in enumerate(files):
+        print 'converting {} of {}: {}'.format(i, len(files), f)
+        transitions = _load_transitions(os.path.join(source_dir, f))
+        goal_poses = [openrave_manager.get_target_pose(transition[-6]) for transition in transitions]
+        writer.add(transitions, goal_poses)
+    writer.close()
+    print 'done converting {} to {}: {}'.format(source_dir, target_dir, get_counts(target_dir))
+
+
+if __name__ == '__main__':
+    import yaml
+    from openrave_manager import OpenraveManager
+    from potential_point import PotentialPoint
+
+    config_path = os.path.join(os.getcwd(), 'config/reward_config.yml')
+    with open(config_path, 'r') as yml_file:
+        config = yaml.load(yml_file)
+    scenario = config['general']['scenario']
+    openrave_manager = OpenraveManager(0.001, PotentialPoint.from_config(config))
+    for data_type in ['train', 'test']:
+        # the location train_supervised_reward.Oversampler reads from
+        source_dir = os.path.join('supervised_data', scenario + '_by_status', data_type)
+        target_dir = os.path.join('supervised_data_columns', scenario + '_by_status', data_type)
+        convert_to_columns(source_dir, target_dir, openrave_manager)
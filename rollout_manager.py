@@ -3,14 +3,16 @@ import os
 import copy
 import random
 import bz2
+import ctypes
 import numpy as np
-import tensorflow as tf
 import multiprocessing
 import Queue
 import datetime
 import time
 
-from network import Network
+from image_cache import ImageCache
+from numpy_actor import NumpyActor
+from numpy_reward import NumpyReward
 from openrave_rl_interface import OpenraveRLInterface
 
 
@@ -66,17 +68,29 @@ class FixedQueryCollectorProcess(multiprocessing.Process):
 
 
 class ActorProcess(multiprocessing.Process):
-    def __init__(self, config, generate_episode_queue, result_queue, actor_specific_queue, image_cache=None):
+    def __init__(self, config, generate_episode_queue, result_queue, actor_specific_queue, params_directory=None,
+                 shared_weights=None):
         multiprocessing.Process.__init__(self)
         self.generate_episode_queue = generate_episode_queue
         self.result_queue = result_queue
         self.actor_specific_queue = actor_specific_queue
         self.config = config
-        self.image_cache = image_cache
-        self.use_vision = image_cache is not None
+        # with vision, only the directory of the image archive is given, the archive is memory mapped in run
+        self.params_directory = params_directory
+        self.use_vision = params_directory is not None
+        # optional shared memory buffers (online and target) the flat weights are broadcast through
+        self.shared_weights = shared_weights
+        # if set, the reward model alters the train episodes in the actor (instead of EpisodeEditor in the learner)
+        self.alter_episode_mode = 0
+        if 'alter_episode_in_actors' in config['model'] and config['model']['alter_episode_in_actors'] and \
+                config['model']['use_reward_model']:
+            self.alter_episode_mode = config['model']['alter_episode']
         # members to set at runtime
         self.openrave_interface = None
         self.actor = None
+        self.reward_model = None
+        self.images = None
+        self.image_rows = None
 
     def _get_sampled_action(self, action):
         totally_random = np.random.binomial(1, self.config['model']['random_action_probability'], 1)[0]
@@ -100,15 +114,15 @@ class ActorProcess(multiprocessing.Process):
         joints = joints[1:]
         return joints, poses, jacobians
 
-    def _run_episode(self, sess, query_params, is_train):
+    def _run_episode(self, query_params, is_train):
         trajectory = query_params[0]
         trajectory_poses = query_params[1]
         if self.use_vision:
             # if we are doing multiple workspaces needs to load the correct one from the cache
             workspace_id = query_params[2]
-            cache_item = self.image_cache.items[workspace_id]
-            workspace_image = cache_item.np_array
-            self.openrave_interface.openrave_manager.set_params(cache_item.full_filename)
+            # a view into the shared archive (no copy)
+            workspace_image = self.images[self.image_rows[workspace_id]]
+            self.openrave_interface.openrave_manager.set_params(os.path.join(self.params_directory, workspace_id))
         else:
             workspace_id = None
             workspace_image = None
@@ -131,15 +145,25 @@ class ActorProcess(multiprocessing.Process):
         status = None
         # compute the maximal number of steps to execute
         max_steps = int(steps_required_for_motion_plan * self.config['general']['max_path_slack'])
+        # only train episodes are altered
+        alter_episode_mode = self.alter_episode_mode if is_train else 0
         for j in range(max_steps):
             # do a single step prediction
             action_mean = self.actor.predict_action(
-                [current_state[0]], [workspace_image], [goal_pose], [goal_joints], sess, use_online_network=is_train
+                [current_state[0]], [workspace_image], [goal_pose], [goal_joints], use_online_network=is_train
             )[0]
             sampled_action = self._get_sampled_action(action_mean) if is_train else action_mean
             # make an environment step
             openrave_step = np.insert(sampled_action, 0, [0.0])
             next_joints, current_reward, is_terminal, status = self.openrave_interface.step(openrave_step)
+            if alter_episode_mode == 1:
+                # use the learned reward and status, the episode is truncated once it is predicted to end
+                fake_reward, fake_status_prob = self.reward_model.make_prediction(
+                    [current_state[0]], [goal_joints], [sampled_action], [goal_pose], images=[workspace_image]
+                )
+                current_reward = fake_reward[0, 0]
+                status = np.argmax(fake_status_prob[0]) + 1
+                is_terminal = is_terminal or status != 1
             # set a new current state
             current_state = self._compute_state(next_joints)
             # update return data structures
@@ -149,6 +173,16 @@ class ActorProcess(multiprocessing.Process):
             # break if needed
             if is_terminal:
                 break
+        if alter_episode_mode == 2:
+            # use the learned reward for the entire episode (labeled as in EpisodeEditor)
+            one_hot_status = np.zeros((len(actions), 3), dtype=np.float32)
+            one_hot_status[:-1, 0] = 1.0
+            one_hot_status[-1, 2] = 1.0
+            fake_rewards, _ = self.reward_model.make_prediction(
+                [state[0] for state in states[:-1]], [goal_joints] * len(actions), actions,
+                [goal_pose] * len(actions), one_hot_status, images=[workspace_image] * len(actions)
+            )
+            rewards = list(fake_rewards[:, 0])
         # return the trajectory along with query info
         assert len(states) == len(actions) + 1
         assert len(states) == len(rewards) + 1
@@ -161,14 +195,14 @@ class ActorProcess(multiprocessing.Process):
         episode_example_trajectory = (trajectory, trajectory_poses)
         return episode_agent_trajectory, episode_times, episode_example_trajectory
 
-    def _run_main_loop(self, sess):
+    def _run_main_loop(self):
         while True:
             try:
                 # wait 1 second for a trajectory request
                 next_episode_request = self.generate_episode_queue.get(block=True, timeout=1)
                 query_params = next_episode_request[0]
                 is_train = next_episode_request[1]
-                path = self._run_episode(sess, query_params, is_train)
+                path = self._run_episode(query_params, is_train)
                 self.result_queue.put(path)
                 self.generate_episode_queue.task_done()
             except Queue.Empty:
@@ -179,9 +213,10 @@ class ActorProcess(multiprocessing.Process):
                 if task_type == 0:
                     # need to init the actor, called once.
                     assert self.actor is None
-                    # on init, we only create a part of the graph (online actor model)
-                    self.actor = Network(self.config, is_rollout_agent=True)
-                    sess.run(tf.global_variables_initializer())
+                    # the actor is evaluated in numpy, no tensorflow session is required in the rollout agents
+                    self.actor = NumpyActor(self.config)
+                    if self.alter_episode_mode != 0:
+                        self.reward_model = NumpyReward(self.config)
                     self.actor_specific_queue.task_done()
                 elif task_type == 1:
                     # need to terminate
@@ -191,7 +226,14 @@ class ActorProcess(multiprocessing.Process):
                     # update the weights
                     new_weights = next_actor_specific_task[1]
                     is_online = next_actor_specific_task[2]
-                    self.actor.set_actor_weights(sess, new_weights, is_online=is_online)
+                    if new_weights is None:
+                        # the weights were written to the shared buffer, use them as is (without copying)
+                        new_weights = np.frombuffer(self.shared_weights[is_online], dtype=np.float32)
+                    self.actor.set_actor_flat_weights(new_weights, is_online=is_online)
+                    self.actor_specific_queue.task_done()
+                elif task_type == 3:
+                    # set the reward model weights
+                    self.reward_model.set_weights(next_actor_specific_task[1])
                     self.actor_specific_queue.task_done()
             except Queue.Empty:
                 pass
@@ -199,17 +241,15 @@ class ActorProcess(multiprocessing.Process):
     def run(self):
         params_file = os.path.abspath(os.path.expanduser(self.config['general']['params_file']))
         self.openrave_interface = OpenraveRLInterface(self.config)
+        if self.use_vision:
+            # the pages of the archive are shared by all the processes that map it
+            self.images, index = ImageCache.load_image_archive(self.params_directory)
+            self.image_rows = {workspace_id: row for row, workspace_id in enumerate(index)}
         if not os.path.isdir(params_file):
             if params_file is not None:
                 # we have a single params file - just load it
                 self.openrave_interface.openrave_manager.set_params(params_file)
-
-        with tf.Session(
-                config=tf.ConfigProto(
-                    gpu_options=tf.GPUOptions(per_process_gpu_memory_fraction=self.config['general']['actor_gpu_usage'])
-                )
-        ) as sess:
-            self._run_main_loop(sess)
+        self._run_main_loop()
 
 
 class FixedRolloutManager:
@@ -240,9 +280,17 @@ class FixedRolloutManager:
 
         )
 
+        # the policy weights are broadcast to the actors through shared memory, a sync is a single contiguous copy
+        weights_count = NumpyActor(config).weights_count
+        self.shared_weights = {
+            is_online: multiprocessing.Array(ctypes.c_float, weights_count, lock=False) for is_online in [True, False]
+        }
+
+        # the actors only get the location of the image archive
+        params_directory = None if image_cache is None else image_cache.params_directory
         self.actors = [
             ActorProcess(copy.deepcopy(config), self.episode_generation_queue, self.episode_results_queue,
-                         self.actor_specific_queues[i], image_cache)
+                         self.actor_specific_queues[i], params_directory, self.shared_weights)
             for i in range(actor_processes)
         ]
         # start all the collector processes
@@ -276,8 +324,15 @@ class FixedRolloutManager:
 
         return episodes
 
-    def set_policy_weights(self, weights, is_online):
-        message = (2, weights, is_online)
+    def set_policy_weights(self, flat_weights, is_online):
+        # the actors are idle between episode generations, so the shared buffer can be overwritten in place
+        np.frombuffer(self.shared_weights[is_online], dtype=np.float32)[:] = flat_weights
+        message = (2, None, is_online)
+        self._post_private_message(message, self.actor_specific_queues)
+
+    def set_reward_weights(self, weights):
+        # only valid if the actors alter the episodes (model.alter_episode_in_actors)
+        message = (3, weights)
         self._post_private_message(message, self.actor_specific_queues)
 
     def end(self):
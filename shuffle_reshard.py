@@ -0,0 +1,219 @@
+import bz2
+import os
+import random
+import shutil
+import sys
+import cPickle as pickle
+import multiprocessing
+
+# shuffles a directory of pickled data files (reward or imitation data by workspace) into new files of a fixed size,
+# without holding the data in memory. the samples are counted first, then the first pass scatters every input file into
+# small random buckets and the second pass shuffles groups of buckets and writes them in full files. the groups are
+# formed by the real bucket counts, so all the processes together hold at most memory_budget samples. the leftovers of
+# every group are written to new buckets that are gathered the same way, until a single group writes the last file.
+# all the passes run in parallel.
+
+
+def _get_workspace_id(filename):
+    name_parts = filename.split('_')
+    return '{}_{}'.format(name_parts[0], name_parts[1])
+
+
+def _load_compressed(path):
+    with bz2.BZ2File(path, 'r') as compressed_file:
+        return pickle.load(compressed_file)
+
+
+def _get_length(path):
+    return len(_load_compressed(path))
+
+
+def _write_compressed(path, data):
+    with bz2.BZ2File(path + '.tmp', 'w') as compressed_file:
+        pickle.dump(data, compressed_file)
+    os.rename(path + '.tmp', path)
+
+
+def _scatter(args):
+    source_path, input_index, buckets_dir, number_of_buckets, prepend_workspace_id, seed = args
+    filename = os.path.basename(source_path)
+    workspace_id = _get_workspace_id(filename)
+    data = _load_compressed(source_path)
+    if prepend_workspace_id:
+        data = [tuple([workspace_id] + list(t)) for t in data]
+    else:
+        data = [tuple(list(t) + [workspace_id]) for t in data]
+    random_generator = random.Random(seed)
+    buckets = [[] for _ in range(number_of_buckets)]
+    for t in data:
+        buckets[random_generator.randrange(number_of_buckets)].append(t)
+    # the fragments are temporary, so they are not compressed
+    for bucket_index, bucket in enumerate(buckets):
+        if len(bucket) > 0:
+            with open(os.path.join(buckets_dir, str(bucket_index), '{}.pkl'.format(input_index)), 'wb') as f:
+                pickle.dump(bucket, f, pickle.HIGHEST_PROTOCOL)
+    return int(filename.split('_')[0]), [len(bucket) for bucket in buckets]
+
+
+def _gather(args):
+    group_name, bucket_dirs, new_dir, samples_per_new_file, target_suffix, tail_dir, seed = args
+    data = []
+    for bucket_dir in bucket_dirs:
+        for fragment in os.listdir(bucket_dir):
+            with open(os.path.join(bucket_dir, fragment), 'rb') as f:
+                data.extend(pickle.load(f))
+        shutil.rmtree(bucket_dir)
+    random.Random(seed).shuffle(data)
+    full_files = len(data) / samples_per_new_file
+    written = []
+    for i in range(full_files):
+        # temporary names, the files are numbered when all the groups are done
+        path = os.path.join(new_dir, 'group_{}_{}{}'.format(group_name, i, target_suffix))
+        _write_compressed(path, data[i * samples_per_new_file: (i + 1) * samples_per_new_file])
+        written.append(path)
+    tail = data[full_files * samples_per_new_file:]
+    if len(tail) > 0:
+        if tail_dir is None:
+            # the last group, the tail is the only incomplete file
+            path = os.path.join(new_dir, 'group_{}_{}{}'.format(group_name, full_files, target_suffix))
+            _write_compressed(path, tail)
+            written.append(path)
+        else:
+            # a bucket of its own for the next round
+            os.makedirs(tail_dir)
+            with open(os.path.join(tail_dir, '0.pkl'), 'wb') as f:
+                pickle.dump(tail, f, pickle.HIGHEST_PROTOCOL)
+    return written, len(tail)
+
+
+def _group_buckets(bucket_counts, group_size):
+    # consecutive buckets with at most group_size samples together (a larger bucket is a group of its own)
+    groups = [[]]
+    group_count = 0
+    for bucket_index, count in enumerate(bucket_counts):
+        if len(groups[-1]) > 0 and group_count + count > group_size:
+            groups.append([])
+            group_count = 0
+        groups[-1].append(bucket_index)
+        group_count += count
+    return groups
+
+
+def reshard(source_dir, new_dir, source_suffix, target_suffix, prepend_workspace_id, samples_per_new_file=1000,
+            memory_budget=1000000, processes=None):
+    if not os.path.exists(new_dir):
+        os.makedirs(new_dir)
+    log_file = open(os.path.join(new_dir, 'creation_log.txt'), 'w')
+
+    def write_to_log(message):
+        print message
+        log_file.write('{}{}'.format(message, os.linesep))
+        log_file.flush()
+
+    source_files = sorted([f for f in os.listdir(source_dir) if f.endswith(source_suffix)])
+    assert len(source_files) > 0
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # the samples a single process may hold in the second pass. a tail is smaller than a file, so a group of at least
+    # two files always writes one and the rounds over the tails end
+    group_size = max(2 * samples_per_new_file, memory_budget / processes)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # the buckets are half a group on average, so a bucket is larger than a group only by a very unlikely chance
+        total_size = sum(pool.map(_get_length, [os.path.join(source_dir, f) for f in source_files]))
+        number_of_buckets = max(1, -(-2 * total_size // group_size))
+        buckets_dir = os.path.join(new_dir, 'buckets')
+        for bucket_index in range(number_of_buckets):
+            os.makedirs(os.path.join(buckets_dir, str(bucket_index)))
+        print 'shuffling {} files from {} through {} buckets'.format(len(source_files), source_dir, number_of_buckets)
+
+        # first pass: scatter
+        workspace_serial_to_count = {}
+        bucket_counts = [0] * number_of_buckets
+        entire_data_length = 0
+        scatter_tasks = [
+            (os.path.join(source_dir, filename), input_index, buckets_dir, number_of_buckets, prepend_workspace_id,
+             random.getrandbits(32))
+            for input_index, filename in enumerate(source_files)
+        ]
+        for input_index, (workspace_serial, counts) in enumerate(pool.imap_unordered(_scatter, scatter_tasks)):
+            count = sum(counts)
+            workspace_serial_to_count[workspace_serial] = workspace_serial_to_count.get(workspace_serial, 0) + count
+            bucket_counts = [total + c for total, c in zip(bucket_counts, counts)]
+            entire_data_length += count
+            print 'input files processed {} of {}'.format(input_index + 1, len(source_files))
+
+        # second pass: shuffle every group of buckets and write the full files, the tails of the groups are the
+        # buckets of the next round, until a single group is left
+        bucket_dirs = [os.path.join(buckets_dir, str(bucket_index)) for bucket_index in range(number_of_buckets)]
+        written = []
+        gather_round = 0
+        while len(bucket_dirs) > 0:
+            groups = _group_buckets(bucket_counts, group_size)
+            print 'gathering {} samples in {} groups of up to {} samples'.format(
+                sum(bucket_counts), len(groups), max(sum(bucket_counts[i] for i in group) for group in groups))
+            if len(groups) == 1:
+                tail_dirs = [None]
+            else:
+                tail_dirs = [os.path.join(buckets_dir, '{}_{}'.format(gather_round, i)) for i in range(len(groups))]
+            gather_tasks = [
+                ('{}_{}'.format(gather_round, group_index), [bucket_dirs[i] for i in group], new_dir,
+                 samples_per_new_file, target_suffix, tail_dirs[group_index], random.getrandbits(32))
+                for group_index, group in enumerate(groups)
+            ]
+            next_bucket_dirs = []
+            next_bucket_counts = []
+            for tail_dir, (group_written, tail_count) in zip(tail_dirs, pool.imap(_gather, gather_tasks)):
+                written.extend(group_written)
+                if tail_count > 0 and tail_dir is not None:
+                    next_bucket_dirs.append(tail_dir)
+                    next_bucket_counts.append(tail_count)
+                print 'output files produced {}'.format(len(written))
+            bucket_dirs = next_bucket_dirs
+            bucket_counts = next_bucket_counts
+            gather_round += 1
+        shutil.rmtree(buckets_dir)
+        if entire_data_length % samples_per_new_file != 0:
+            write_to_log('warning: last file is not complete, choose a file size that is a multiplier of the number of '
+                         'elements!')
+            write_to_log('number of elements: {}, file size {}'.format(entire_data_length, samples_per_new_file))
+    finally:
+        pool.close()
+        pool.join()
+
+    # number the output files in a random order
+    random.shuffle(written)
+    for output_file_index, path in enumerate(written):
+        os.rename(path, os.path.join(new_dir, '{}{}'.format(output_file_index, target_suffix)))
+
+    for workspace_serial in sorted(workspace_serial_to_count):
+        write_to_log('workspace {} has {} entries'.format(
+            workspace_serial, workspace_serial_to_count[workspace_serial]))
+
+    write_to_log('number of workspaces: {}'.format(len(workspace_serial_to_count)))
+    write_to_log('minimal workspace serial is {}'.format(min(workspace_serial_to_count.keys())))
+    write_to_log('maximal workspace serial is {}'.format(max(workspace_serial_to_count.keys())))
+    write_to_log('avg count per workspace is {}'.format(
+        sum(workspace_serial_to_count.values()) / float(len(workspace_serial_to_count))))
+    log_file.close()
+    print 'done'
+
+
+if __name__ == '__main__':
+    # usage: python shuffle_reshard.py [reward|imitation]
+    data_type = sys.argv[1] if len(sys.argv) > 1 else 'reward'
+    if data_type == 'reward':
+        # source_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_by_workspace/test')
+        source_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_by_workspace/train')
+        # new_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_shuffled/test')
+        new_dir = os.path.expanduser('~/ModelBasedDDPG/supervised_data/vision_harder_shuffled/train')
+        # the workspace id is the first element of the reward tuples
+        reshard(source_dir, new_dir, '.pkl', '.pkl', prepend_workspace_id=True)
+    elif data_type == 'imitation':
+        source_dir = os.path.expanduser('~/ModelBasedDDPG/imitation_data/vision/train')
+        new_dir = os.path.expanduser('~/ModelBasedDDPG/imitation_data/vision_shuffled/train')
+        # the workspace id is the last element of the imitation tuples
+        reshard(source_dir, new_dir, '.path_pkl', '.path_pkl', prepend_workspace_id=False)
+    else:
+        assert False
@@ -48,7 +48,7 @@ def get_queries():
 
 queries = get_queries()
 queries = queries[:query_limit]
-image_cache = ImageCache(config['general']['params_file'], create_images=True)
+image_cache = ImageCache(config['general']['params_file'], create_images=True, lazy=True)
 
 
 def run_network_single(sess, openrave_rl_interface, network, trajectory, workspace_image):
@@ -10,6 +10,7 @@ import yaml
 import tensorflow as tf
 import multiprocessing
 
+from cache_builder import produce_paths, produce_transitions
 from network import Network
 from potential_point import PotentialPoint
 from rollout_manager import ActorProcess
@@ -37,99 +38,19 @@ config['general']['params_file'] = os.path.abspath(
 test_batch_size = batch_size * 10
 
 
-def produce_transitions(data_dir, cache_dir):
-    print 'producing transition data from original trajectories at {}'.format(data_dir)
-    assert os.path.exists(data_dir)
-
-    if os.path.exists(cache_dir):
-        print 'found cache dir at {}, assuming all transitions are present there (if not delete the directory)'.format(
-            cache_dir)
-        return
-
-    print 'cache not found, creating cache at: {}'.format(cache_dir)
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-    files = [file for file in os.listdir(data_dir) if file.endswith(".path_pkl")]
-    assert len(files) > 0
-    target_point = PotentialPoint.from_config(config)[-1]
-    for file in files:
-        print 'loading file {}'.format(file)
-        with bz2.BZ2File(os.path.join(data_dir, file), 'r') as compressed_file:
-            paths = pickle.load(compressed_file)
-
-        print 'asserting step sizes match'
-        step_size = config['openrave_rl']['action_step_size'] + 0.00001
-        for (traj, _) in paths:
-            for i in range(len(traj) - 1):
-                assert np.linalg.norm(np.array(traj[i]) - np.array(traj[i + 1])) < step_size
-
-        print 'creating transitions'
-        transitions = []
-        for (traj, poses_trajectory) in paths:
-            goal_joints = traj[-1]
-            goal_pose = poses_trajectory[-1][target_point.tuple]
-            for i in range(len(traj) - 1):
-                joints = traj[i]
-                next_joints = traj[i + 1]
-                transition = (joints[1:], next_joints[1:], goal_joints[1:], goal_pose)
-                transitions.append(transition)
-
-        transition_file = os.path.join(cache_dir, file + '.transitions_cache')
-        print 'writing transitions file {}'.format(transition_file)
-        with open(transition_file, 'w') as pickle_file:
-            pickle.dump(transitions, pickle_file)
-        # with bz2.BZ2File(transition_file, 'w') as compressed_file:
-        #     pickle.dump(transitions, compressed_file)
-
-    print 'cache created at {}'.format(cache_dir)
-
-
-def produce_paths(data_dir, cache_dir):
-    print 'producing paths data from original trajectories at {}'.format(data_dir)
-    assert os.path.exists(data_dir)
-
-    if os.path.exists(cache_dir):
-        print 'found cache dir at {}, assuming all paths are present there (if not delete the directory)'.format(
-            cache_dir)
-        return
-
-    print 'cache not found, creating cache at: {}'.format(cache_dir)
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-    files = [file for file in os.listdir(data_dir) if file.endswith(".path_pkl")]
-    assert len(files) > 0
-    for file in files:
-        print 'loading file {}'.format(file)
-        with bz2.BZ2File(os.path.join(data_dir, file), 'r') as compressed_file:
-            paths = pickle.load(compressed_file)
-
-        print 'asserting step sizes match'
-        step_size = config['openrave_rl']['action_step_size'] + 0.00001
-        for (traj, _) in paths:
-            for i in range(len(traj) - 1):
-                assert np.linalg.norm(np.array(traj[i]) - np.array(traj[i + 1])) < step_size
-
-        paths_file = os.path.join(cache_dir, file + '.paths_cache')
-        print 'writing paths file {}'.format(paths_file)
-        with open(paths_file, 'w') as pickle_file:
-            pickle.dump(paths, pickle_file)
-
-    print 'cache created at {}'.format(cache_dir)
-
-
 train_original_dir = os.path.join('imitation_data', scenario, 'train')
 train_transitions_dir = os.path.join('imitation_data_transitions', scenario, 'train')
 train_transitions_dir = os.path.join(train_transitions_dir, PotentialPoint.from_config(config)[-1].str)
-produce_transitions(train_original_dir, train_transitions_dir)
+produce_transitions(train_original_dir, train_transitions_dir, config)
 train_paths_dir = os.path.join('imitation_data_paths', scenario, 'train')
-produce_paths(train_original_dir, train_paths_dir)
+produce_paths(train_original_dir, train_paths_dir, config)
 
 test_original_dir = os.path.join('imitation_data', scenario, 'test')
 test_transitions_dir = os.path.join('imitation_data_transitions', scenario, 'test')
 test_transitions_dir = os.path.join(test_transitions_dir, PotentialPoint.from_config(config)[-1].str)
-produce_transitions(test_original_dir, test_transitions_dir)
+produce_transitions(test_original_dir, test_transitions_dir, config)
 test_paths_dir = os.path.join('imitation_data_paths', scenario, 'test')
-produce_paths(test_original_dir, test_paths_dir)
+produce_paths(test_original_dir, test_paths_dir, config)
 
 
 def get_files(paths_dir, transitions_dir, max_files=None):
@@ -408,7 +329,7 @@ with tf.Session(
 
         # test
         # copy the online weights to the offline policy
-        actor_trained_weights = network.get_actor_weights(sess, is_online=True)
+        actor_trained_weights = network.get_actor_flat_weights(sess, is_online=True)
         rollout_manager.set_policy_weights(actor_trained_weights, is_online=False)
         # do trajectory evaluations
         eval_result = train_trajectory_eval.eval(current_global_step, config['test']['number_of_episodes'], is_train=True)
@@ -1,4 +1,8 @@
+from cache_builder import build_cache, decompress_pickle
 from image_cache import ImageCache
+from partition_supervised_data_by_status import load_manifest
+from prefetch_pipeline import PrefetchPipeline
+import reward_data_columns
 from pre_trained_reward import *
 from openrave_manager import OpenraveManager
 from potential_point import PotentialPoint
@@ -10,100 +14,36 @@ import random
 import os
 import yaml
 import tensorflow as tf
-import multiprocessing
-import Queue
-
-
-class UnzipperProcess(multiprocessing.Process):
-    def __init__(self, number_of_unzippers, files_queue, result_queue, unzipper_specific_queue):
-        multiprocessing.Process.__init__(self)
-        self.number_of_unzippers = number_of_unzippers
-        self.files_queue = files_queue
-        self.result_queue = result_queue
-        self.unzipper_specific_queue = unzipper_specific_queue
-
-    def run(self):
-        while True:
-            try:
-                if self.result_queue.qsize() < self.number_of_unzippers:
-                    next_file = self.files_queue.get(block=True, timeout=1)
-                    with open(next_file, 'r') as source_file:
-                        result = pickle.load(source_file)
-                    self.result_queue.put(result)
-                    self.result_queue.task_done()
-                else:
-                    time.sleep(1)
-            except Queue.Empty:
-                pass
-            try:
-                # only option is to break
-                task_type = self.unzipper_specific_queue.get(block=True, timeout=0.001)
-                break
-            except Queue.Empty:
-                pass
-
-
-class UnzipperIterator:
-    def __init__(self, number_of_unzippers, files):
-        self.number_of_unzippers = number_of_unzippers
-        self.files = files
-
-        self.unzipper_specific_queues = [multiprocessing.JoinableQueue() for _ in range(number_of_unzippers)]
-        self.files_queue = multiprocessing.JoinableQueue()
-        self.results_queue = multiprocessing.JoinableQueue()
-
-        self.unzippers = [UnzipperProcess(
-            number_of_unzippers, self.files_queue, self.results_queue, self.unzipper_specific_queues[i])
-            for i in range(number_of_unzippers)]
-
-        for u in self.unzippers:
-            u.start()
-
-    def __iter__(self):
-        random.shuffle(self.files)
-        # put all the files
-        for f in self.files:
-            self.files_queue.put(f)
-        # when ready - collect the zipped files
-        for i in range(len(self.files)):
-            unzipped = self.results_queue.get()
-            yield unzipped
-
-    def end(self):
-        for u in self.unzippers:
-            u.terminate()
-        time.sleep(10)
 
 
 class RewardDataLoader:
-    def __init__(self, data_dir, status_to_read, number_of_unzippers=None):
+    def __init__(self, data_dir, status_to_read, number_of_unzippers=None, prefetch_depth=None):
         assert os.path.exists(data_dir)
         cache_dir = data_dir.replace('supervised_data', 'supervised_data_cache')
-        if not os.path.exists(cache_dir):
-            self._create_cache(data_dir, cache_dir)
+        self._create_cache(data_dir, cache_dir)
 
-        files = [f for f in os.listdir(data_dir) if f.endswith(".pkl") and f.startswith('{}_'.format(status_to_read))]
+        manifest = load_manifest(data_dir)
+        if manifest is None:
+            files = [
+                f for f in os.listdir(data_dir) if f.endswith(".pkl") and f.startswith('{}_'.format(status_to_read))
+            ]
+        else:
+            # partitioned by partition_supervised_data_by_status, no need to scan the directory
+            files = manifest['statuses'][status_to_read]['files']
         assert len(files) > 0
         self.cache_dir = cache_dir
         self.files = [os.path.join(self.cache_dir, f) for f in files]
 
         self.files_iterator = None
         if number_of_unzippers is not None:
-            self.files_iterator = UnzipperIterator(number_of_unzippers, self.files)
+            if prefetch_depth is None:
+                prefetch_depth = number_of_unzippers
+            self.files_iterator = PrefetchPipeline(number_of_unzippers, prefetch_depth)
 
     @staticmethod
     def _create_cache(data_dir, cache_dir):
-        print 'creating cache for {} in {}'.format(data_dir, cache_dir)
-        os.makedirs(cache_dir)
-        files = [f for f in os.listdir(data_dir) if f.endswith(".pkl")]
-        for f in files:
-            destination_file = os.path.join(cache_dir, f)
-            print 'caching {}'.format(f)
-            with bz2.BZ2File(os.path.join(data_dir, f), 'r') as compressed_file:
-                data = pickle.load(compressed_file)
-                with open(destination_file, 'w') as cache_file:
-                    pickle.dump(data, cache_file)
-        print 'done creating cache for {} in {}'.format(data_dir, cache_dir)
+        # resumes an incomplete cache, and updates the files that changed in data_dir
+        build_cache(data_dir, cache_dir, '.pkl', '', decompress_pickle)
 
     def __iter__(self):
         random.shuffle(self.files)
@@ -112,7 +52,7 @@ class RewardDataLoader:
                 with open(f, 'r') as source_file:
                     yield pickle.load(source_file)
         else:
-            for content in self.files_iterator:
+            for content in self.files_iterator.iterate(self.files):
                 yield content
 
     def stop(self):
@@ -120,49 +60,42 @@ class RewardDataLoader:
             self.files_iterator.end()
 
 
-class Batcher:
-    def __init__(self, input_iterator, batch_size, shuffle_before_yield):
-        self.input_iterator = input_iterator
-        self.batch_size = batch_size
-        self.shuffle_before_yield = shuffle_before_yield
-
-    def __iter__(self):
-        current_batch = []
-        for tuple_list in self.input_iterator:
-            for t in tuple_list:
-                current_batch.append(t)
-                if len(current_batch) == self.batch_size:
-                    if self.shuffle_before_yield:
-                        random.shuffle(current_batch)
-                    yield current_batch
-                    current_batch = []
-        if self.shuffle_before_yield:
-            random.shuffle(current_batch)
-        yield current_batch
-
-
 class Oversampler:
-    def __init__(self, data_dir, free_class_batch_size, oversample_goal, oversample_collision,
-                 shuffle_batch_multiplier=2, number_of_unzippers=None):
+    # batches of free transitions (the whole class is shuffled every epoch), each extended with goal and collision
+    # transitions sampled with replacement. all the classes are read from the columnar data (see reward_data_columns)
+    def __init__(self, data_dir, free_class_batch_size, oversample_goal, oversample_collision, openrave_manager,
+                 image_cache=None, number_of_unzippers=None, prefetch_depth=None):
         self.data_dir = data_dir
+        self.free_class_batch_size = free_class_batch_size
         self.oversample_goal = oversample_goal
         self.oversample_collision = oversample_collision
+        self.image_cache = image_cache
+
+        columns_dir = data_dir.replace('supervised_data', 'supervised_data_columns')
+        if not os.path.isfile(os.path.join(columns_dir, reward_data_columns.META_FILENAME)):
+            self._create_columns(data_dir, columns_dir, openrave_manager, number_of_unzippers, prefetch_depth)
+        potential_point = openrave_manager.potential_points[-1].tuple
+        self.free = reward_data_columns.ColumnarRewardData(columns_dir, 1, potential_point)
+        self.collisions = reward_data_columns.ColumnarRewardData(columns_dir, 2, potential_point)
+        self.goals = reward_data_columns.ColumnarRewardData(columns_dir, 3, potential_point)
+        self._describe_data(columns_dir)
 
-        # load data
-        self.all_collisions = self._load_all(RewardDataLoader(data_dir, 2, None))
-        self.all_goals = self._load_all(RewardDataLoader(data_dir, 3, None))
-        self.free_transitions_iterator = RewardDataLoader(data_dir, 1, number_of_unzippers=number_of_unzippers)
-        self._describe_data(self.free_transitions_iterator)
-
-        inner_batcher = Batcher(self.free_transitions_iterator, free_class_batch_size * shuffle_batch_multiplier, True)
-        self.batcher = Batcher(inner_batcher, free_class_batch_size, False)
-
-    def _describe_data(self, free_transitions_iterator):
-        free_count = 0
-        for tuple_list in free_transitions_iterator:
-            free_count += len(tuple_list)
-        collision_count = len(self.all_collisions)
-        goal_count = len(self.all_goals)
+    @staticmethod
+    def _create_columns(data_dir, columns_dir, openrave_manager, number_of_unzippers, prefetch_depth):
+        print 'creating columnar data for {} in {}'.format(data_dir, columns_dir)
+        writer = reward_data_columns.ColumnarWriter(columns_dir, openrave_manager.potential_points[-1].tuple)
+        for status in reward_data_columns.STATUSES:
+            loader = RewardDataLoader(data_dir, status, number_of_unzippers, prefetch_depth)
+            for tuple_list in loader:
+                goal_poses = [openrave_manager.get_target_pose(t[-6]) for t in tuple_list]
+                writer.add(tuple_list, goal_poses)
+            loader.stop()
+        writer.close()
+
+    def _describe_data(self, columns_dir):
+        # the counts are read from the metadata
+        counts = reward_data_columns.get_counts(columns_dir)
+        free_count, collision_count, goal_count = counts[1], counts[2], counts[3]
         all_count = free_count + collision_count + goal_count
 
         print 'data dir: {}'.format(self.data_dir)
@@ -171,29 +104,26 @@ class Oversampler:
         print 'goal: {} ({})'.format(goal_count, float(goal_count) / all_count)
         print ''
 
-    @staticmethod
-    def _load_all(files_iterator):
-        all_transitions = []
-        for tuple_list in files_iterator:
-            all_transitions.extend(tuple_list)
-        return all_transitions
-
-    def _oversample_result(self, free_transition_batch):
-        batch_size = len(free_transition_batch)
-        goal_sample_size = int(self.oversample_goal * batch_size)
-        goal_indices = list(np.random.choice(len(self.all_goals), goal_sample_size))
-        goal_current_batch = [self.all_goals[i] for i in goal_indices]
-        collision_sample_size = int(self.oversample_collision * batch_size)
-        collision_indices = list(np.random.choice(len(self.all_collisions), collision_sample_size))
-        collision_current_batch = [self.all_collisions[i] for i in collision_indices]
-        return free_transition_batch + goal_current_batch + collision_current_batch
+    def _oversample_result(self, free_indices):
+        batch_size = len(free_indices)
+        goal_indices = np.random.choice(len(self.goals), int(self.oversample_goal * batch_size))
+        collision_indices = np.random.choice(len(self.collisions), int(self.oversample_collision * batch_size))
+        class_batches = [
+            self.free.gather(free_indices), self.goals.gather(goal_indices), self.collisions.gather(collision_indices)
+        ]
+        columns = {
+            field: np.concatenate([class_batch[field] for class_batch in class_batches])
+            for field, _ in reward_data_columns.FIELDS
+        }
+        return reward_data_columns.get_batch_and_labels(columns, self.free, self.image_cache)
+
+    def get_random_batch(self):
+        return self._oversample_result(np.random.choice(len(self.free), self.free_class_batch_size, replace=False))
 
     def __iter__(self):
-        for free_transition_batch in self.batcher:
-            yield self._oversample_result(free_transition_batch)
-
-    def stop(self):
-        self.free_transitions_iterator.stop()
+        free_indices = np.random.permutation(len(self.free))
+        for start in range(0, len(free_indices), self.free_class_batch_size):
+            yield self._oversample_result(free_indices[start: start + self.free_class_batch_size])
 
 
 model_name = datetime.datetime.fromtimestamp(time.time()).strftime('%Y_%m_%d_%H_%M_%S')
@@ -227,16 +157,17 @@ train_data_dir = os.path.join(base_data_dir, 'train')
 test_data_dir = os.path.join(base_data_dir, 'test')
 
 
-number_of_unzippers = config['general']['number_of_unzippers']
-
-train = Oversampler(train_data_dir, batch_size, oversample_goal, oversample_collision,
-                    number_of_unzippers=number_of_unzippers)
-test = Oversampler(test_data_dir, batch_size, oversample_goal, oversample_collision,
-                   number_of_unzippers=number_of_unzippers)
-
 # get openrave manager
 openrave_manager = OpenraveManager(0.001, PotentialPoint.from_config(config))
 
+number_of_unzippers = config['general']['number_of_unzippers']
+prefetch_depth = config['general']['prefetch_depth']
+
+train = Oversampler(train_data_dir, batch_size, oversample_goal, oversample_collision, openrave_manager,
+                    image_cache=image_cache, number_of_unzippers=number_of_unzippers, prefetch_depth=prefetch_depth)
+test = Oversampler(test_data_dir, batch_size, oversample_goal, oversample_collision, openrave_manager,
+                   image_cache=image_cache, number_of_unzippers=number_of_unzippers, prefetch_depth=prefetch_depth)
+
 # set summaries and saver dir
 summaries_dir = os.path.join('reward', 'tensorboard')
 train_summary_writer = tf.summary.FileWriter(os.path.join(summaries_dir, 'train_' + model_name))
@@ -332,8 +263,7 @@ with tf.Session(
     current_global_step = 0
     for epoch in range(epochs):
         # run train for one epoch
-        for train_batch in train:
-            train_batch, train_rewards, train_status = get_batch_and_labels(train_batch, openrave_manager, image_cache)
+        for train_batch, train_rewards, train_status in train:
             train_status_one_hot = np.zeros((len(train_rewards), 3), dtype=np.float32)
             train_status_one_hot[np.arange(len(train_rewards)), np.array(train_status)-1] = 1.0
             train_feed = pre_trained_reward.make_feed(*train_batch, all_transition_labels=train_status_one_hot)
@@ -351,10 +281,7 @@ with tf.Session(
 
         if current_global_step > 0:
             # run test for one (random) batch
-            test_batch = None
-            for test_batch in test:
-                break
-            test_batch, test_rewards, test_status = get_batch_and_labels(test_batch, openrave_manager, image_cache)
+            test_batch, test_rewards, test_status = test.get_random_batch()
             test_feed = pre_trained_reward.make_feed(*test_batch)
             test_feed[reward_input] = np.expand_dims(np.array(test_rewards), axis=1)
             test_feed[status_input] = np.array(test_status)
@@ -381,5 +308,3 @@ with tf.Session(
                 pre_trained_reward.saver.save(sess, os.path.join(saver_dir, 'reward'), global_step=current_global_step)
         print 'done epoch {} of {}, global step {}'.format(epoch, epochs, current_global_step)
 
-train.stop()
-test.stop()
@@ -168,6 +168,77 @@ class WorkspaceParams:
         return res
 
 
+def are_boxes_overlapping(centers_a, sides_a, rotations_a, centers_b, sides_b, rotations_b):
+    # separating axis test of rotated rectangles (rotated by -rotation around the center, as in _get_box_polygon), all
+    # the arguments are broadcast together: centers of (..., 2), sides of (..., 2) and rotations of (...)
+    def get_axes(rotations):
+        cos, sin = np.cos(rotations), np.sin(rotations)
+        # the box x and z axes, of (..., 2, 2)
+        return np.stack([np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2)
+
+    axes_a = get_axes(np.array(rotations_a))
+    axes_b = get_axes(np.array(rotations_b))
+    half_sides_a = np.array(sides_a) / 2.0
+    half_sides_b = np.array(sides_b) / 2.0
+    center_difference = np.array(centers_b) - np.array(centers_a)
+    # the candidate separating axes are the box axes of both boxes, of (..., 4, 2)
+    axes = np.concatenate(np.broadcast_arrays(axes_a, axes_b), axis=-2)
+    # the projected half lengths of the boxes and of the centers distance, on every axis
+    radius_a = np.sum(half_sides_a[..., None, :] * np.abs(np.einsum('...ij,...kj->...ik', axes, axes_a)), axis=-1)
+    radius_b = np.sum(half_sides_b[..., None, :] * np.abs(np.einsum('...ij,...kj->...ik', axes, axes_b)), axis=-1)
+    distance = np.abs(np.einsum('...ij,...j->...i', axes, center_difference))
+    return np.all(distance <= radius_a + radius_b, axis=-1)
+
+
+class WorkspaceParamsBatch:
+    # many workspaces as arrays of (number_of_workspaces, max_obstacles), the obstacles of workspace i are the first
+    # number_of_obstacles[i] columns (the rest are padding)
+    def __init__(self, number_of_obstacles, centers_position_x, centers_position_z, sides_x, sides_z, y_axis_rotation,
+                 rays):
+        self.number_of_obstacles = number_of_obstacles
+        self.centers_position_x = centers_position_x
+        self.centers_position_z = centers_position_z
+        self.sides_x = sides_x
+        self.sides_z = sides_z
+        self.y_axis_rotation = y_axis_rotation
+        self.rays = rays
+
+    def __len__(self):
+        return len(self.number_of_obstacles)
+
+    def select(self, indices):
+        return WorkspaceParamsBatch(
+            self.number_of_obstacles[indices], self.centers_position_x[indices], self.centers_position_z[indices],
+            self.sides_x[indices], self.sides_z[indices], self.y_axis_rotation[indices], self.rays[indices]
+        )
+
+    def get_workspace_params(self, index):
+        result = WorkspaceParams()
+        number_of_obstacles = int(self.number_of_obstacles[index])
+        result.number_of_obstacles = number_of_obstacles
+        result.centers_position_x = [float(x) for x in self.centers_position_x[index, :number_of_obstacles]]
+        result.centers_position_z = [float(z) for z in self.centers_position_z[index, :number_of_obstacles]]
+        result.sides_x = [float(s) for s in self.sides_x[index, :number_of_obstacles]]
+        result.sides_z = [float(s) for s in self.sides_z[index, :number_of_obstacles]]
+        result.y_axis_rotation = [float(r) for r in self.y_axis_rotation[index, :number_of_obstacles]]
+        result.rays = [float(r) for r in self.rays[index, :number_of_obstacles]]
+        return result
+
+    def has_overlapping_obstacles(self):
+        # for every workspace, whether any two of its obstacles overlap
+        centers = np.stack([self.centers_position_x, self.centers_position_z], axis=-1)
+        sides = np.stack([self.sides_x, self.sides_z], axis=-1)
+        # all the pairs (i, j), i < j of every workspace
+        first, second = np.triu_indices(self.centers_position_x.shape[1], k=1)
+        is_overlapping = are_boxes_overlapping(
+            centers[:, first], sides[:, first], self.y_axis_rotation[:, first],
+            centers[:, second], sides[:, second], self.y_axis_rotation[:, second]
+        )
+        # pairs with a padding obstacle do not count
+        is_overlapping &= second[None, :] < self.number_of_obstacles[:, None]
+        return np.any(is_overlapping, axis=1)
+
+
 class WorkspaceGenerator:
     # problem settings
     center_offset = np.array([0.0, 0.125])
@@ -258,6 +329,64 @@ class WorkspaceGenerator:
             result.rays.append(ray_angle)
         return result
 
+    def _get_max_obstacles(self):
+        if self.obstacle_count_probabilities is None:
+            return self.max_obstacles
+        return max(self.obstacle_count_probabilities.keys())
+
+    def _generate_workspaces_batch(self, number_of_workspaces):
+        # the same distribution as generate_workspace, for all the workspaces and obstacles at once
+        if self.obstacle_count_probabilities is None:
+            number_of_obstacles = np.random.randint(self.min_obstacles, self.max_obstacles + 1, number_of_workspaces)
+        else:
+            count = self.obstacle_count_probabilities.keys()
+            probabilities = [self.obstacle_count_probabilities[c] for c in count]
+            number_of_obstacles = np.random.choice(count, number_of_workspaces, p=probabilities)
+        shape = (number_of_workspaces, self._get_max_obstacles())
+        ray_angle = np.random.uniform(WorkspaceGenerator.min_angle, WorkspaceGenerator.max_angle, shape)
+        center_distance = np.random.uniform(self.min_center, self.max_center, shape)
+        sides_x = np.random.uniform(self.min_side, self.max_side, shape)
+        sides_z = np.random.uniform(self.min_side, self.max_side, shape)
+        y_axis_rotation = np.random.uniform(0.0, np.pi / 2.0, shape)
+        # the rightmost direction scaled to center_distance and rotated by the ray angle (see _generate_obstacle)
+        direction = WorkspaceGenerator.rightmost_position_centered_direction
+        cos, sin = np.cos(ray_angle), np.sin(ray_angle)
+        centers_x = center_distance * (cos * direction[0] - sin * direction[1]) + WorkspaceGenerator.center_offset[0]
+        centers_z = center_distance * (sin * direction[0] + cos * direction[1]) + WorkspaceGenerator.center_offset[1]
+        return WorkspaceParamsBatch(number_of_obstacles, centers_x, centers_z, sides_x, sides_z, y_axis_rotation,
+                                    ray_angle)
+
+    def generate_workspaces(self, number_of_workspaces, allow_overlapping_obstacles=True):
+        # generates many workspaces at once as a WorkspaceParamsBatch. if overlapping obstacles are not allowed the
+        # workspaces with overlaps are replaced in rounds, every round samples enough workspaces for the estimated
+        # acceptance rate.
+        result = []
+        found = 0
+        acceptance_rate = 1.0
+        while found < number_of_workspaces:
+            missing = number_of_workspaces - found
+            candidates = self._generate_workspaces_batch(int(np.ceil(missing / acceptance_rate)))
+            if not allow_overlapping_obstacles:
+                accepted = np.where(np.logical_not(candidates.has_overlapping_obstacles()))[0]
+                acceptance_rate = max(float(len(accepted)) / len(candidates), 0.01)
+                candidates = candidates.select(accepted)
+            result.append(candidates.select(np.arange(min(missing, len(candidates)))))
+            found += len(result[-1])
+        return WorkspaceParamsBatch(*[
+            np.concatenate([getattr(batch, name) for batch in result], axis=0) for name in [
+                'number_of_obstacles', 'centers_position_x', 'centers_position_z', 'sides_x', 'sides_z',
+                'y_axis_rotation', 'rays'
+            ]
+        ])
+
+    @staticmethod
+    def center_to_ray_angles(centers):
+        # center_to_ray_angle of every row of (rows, 2)
+        centers = np.array(centers) - WorkspaceGenerator.center_offset
+        centers = centers / np.linalg.norm(centers, axis=1)[:, None]
+        ref = WorkspaceGenerator.rightmost_position_centered_direction
+        return np.arccos(np.clip(np.dot(centers, ref), -1.0, 1.0))
+
     def rays_to_slices(self, rays):
         slices_bounds = [WorkspaceGenerator.min_angle, WorkspaceGenerator.max_angle] + rays
         slices_bounds.sort()
@@ -271,6 +400,11 @@ class TrajectoryGenerator:
         self.joint0_position = joint0_position
         # configuration values
         self.print_info = print_info
+        self.valid_joints_batch_size = 10
+        # valid joints that were sampled and not used yet, of the workspace of _valid_joints_params
+        self._valid_joints_params = None
+        self._valid_joints = None
+        self._valid_joints_angles = None
 
     # def plan_start_goal(self, slices, max_planner_iterations):
     #     # get the joint position for the start state, and the related slice
@@ -299,15 +433,31 @@ class TrajectoryGenerator:
             print name, variable
 
     def _get_valid_joints(self, slices, forbidden_slice=None):
+        # valid joints are sampled in batches and kept in a pool (with their target angles) until they are used, the
+        # first whose target is not in the forbidden slice is used. the pool is dropped when the workspace changes.
+        if self._valid_joints is None or self._valid_joints_params is not self.environment.loaded_params:
+            self._valid_joints_params = self.environment.loaded_params
+            self._valid_joints = np.zeros((0, self.environment.get_number_of_joints()))
+            self._valid_joints_angles = np.zeros(0)
         while True:
-            joints = self.environment.get_random_joints({0: 0.0})
-            while not self.environment.is_valid(joints):
-                joints = self.environment.get_random_joints({0: 0.0})
-            target_pose = self.environment.get_target_pose(joints)
-            target_angle = WorkspaceGenerator.center_to_ray_angle(target_pose)
-            target_slice = [i for i in range(len(slices)-1) if slices[i] <= target_angle <= slices[i+1]][0]
-            if forbidden_slice is None or target_slice != forbidden_slice:
-                return joints, target_slice
+            if len(self._valid_joints) == 0:
+                self._valid_joints = self.environment.get_random_valid_joints_batch(
+                    self.valid_joints_batch_size, {0: 0.0})
+                self._valid_joints_angles = WorkspaceGenerator.center_to_ray_angles(
+                    self.environment.get_target_poses(self._valid_joints))
+            # the first slice i such that slices[i] <= target_angle <= slices[i+1]
+            target_slices = np.maximum(np.searchsorted(slices, self._valid_joints_angles, side='left') - 1, 0)
+            allowed = np.where(target_slices != forbidden_slice)[0]
+            if len(allowed) == 0:
+                # all in the forbidden slice, as the rejection loop did
+                self._valid_joints = self._valid_joints[:0]
+                continue
+            i = allowed[0]
+            # the joints before i are in the forbidden slice and are dropped
+            joints, target_slice = tuple(self._valid_joints[i]), int(target_slices[i])
+            self._valid_joints = self._valid_joints[i + 1:]
+            self._valid_joints_angles = self._valid_joints_angles[i + 1:]
+            return joints, target_slice
 
     #
     # def _get_random_joints(self, joint1_position):